@@ -1,12 +1,51 @@
+import numpy as np
+
+# pitch bend values are 14 bit, 8192 is the center (no bend)
+BEND_CENTER = 8192
+# the table holds BEND_STEPS bend values per note, the 14 bit value is rounded to the next one
+BEND_SHIFT = 6
+BEND_STEPS = (16384 >> BEND_SHIFT) + 1
+
+# deviation of every pitch class (C, C#, ... B) from equal temperament in cents
+TUNINGS = {
+    "equal": [0.0] * 12,
+    # 5-limit just intonation on C
+    "just": [0.0, 11.73, 3.91, 15.64, -13.69, -1.96, -9.78, 1.96, 13.69, -15.64, 17.60, -11.73],
+    # pythagorean on C, fifths of 3/2
+    "pythagorean": [0.0, 13.69, 3.91, -5.87, 7.82, -1.96, 11.73, 1.96, 15.64, 5.87, -3.91, 9.78],
+}
+
+
 class FrequencyHandler:
-    def __init__(self, path) -> None:
-        self.LUT = {}
-        with open(path) as f:
-            content = f.readlines()
-            for line in content:
-                key, value = line.split(',')
-                self.LUT[int(key)] = int(round(float(value),0))
-
-    def getFrequency(self, tone):
-        return self.LUT[tone]
-        
+    # Frequency in Hz (as the integer the DSP expects) for every midi note x pitch bend step,
+    # computed once with NumPy. path: optional file of "note, frequency" lines that replaces the
+    # generated base frequency of the listed notes (data/freq.txt). referencePitch is the A4 (note 69)
+    # frequency, it keeps its pitch in every tuning.
+    def __init__(self, path=None, referencePitch=440.0, tuning="equal", bendRange=2) -> None:
+        if tuning not in TUNINGS:
+            raise ValueError("Unknown tuning " + str(tuning))
+        cents = np.array(TUNINGS[tuning])
+        notes = np.arange(128)
+        base = referencePitch * 2.0 ** ((notes - 69 + (cents[notes % 12] - cents[69 % 12]) / 100) / 12)
+        if path is not None:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        key, value = line.split(',')
+                        base[int(key)] = float(value)
+        self.baseFrequencies = base
+        self.bendRange = bendRange
+        # semitones of every bend step, the last step stands for the maximum value 16383
+        steps = np.minimum(np.arange(BEND_STEPS) << BEND_SHIFT, 16383)
+        bendFactors = 2.0 ** ((steps - BEND_CENTER) / BEND_CENTER * bendRange / 12)
+        table = np.rint(base[:, None] * bendFactors[None, :])
+        # the DSP takes 16 bit frequencies
+        self.table = np.clip(table, 0, 0xffff).astype(np.uint16)
+        # plain lists, indexing them is faster than NumPy for single values in the hot path
+        self.LUT = self.table[:, BEND_CENTER >> BEND_SHIFT].tolist()
+        self.rows = self.table.tolist()
+
+    def getFrequency(self, tone, bend=BEND_CENTER):
+        if bend == BEND_CENTER:
+            return self.LUT[tone]
+        return self.rows[tone][(bend + (1 << (BEND_SHIFT - 1))) >> BEND_SHIFT]
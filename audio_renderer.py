@@ -0,0 +1,113 @@
+import argparse
+import os
+import wave
+import numpy as np
+from dsp_interface import ChannelHandler
+from player import TimelinePlayer, VirtualClock
+from transport import DSPCommands, SimulatedTransport
+
+
+class OfflineTransport(SimulatedTransport):
+    # simulated board whose commands are stamped with the song time of a VirtualClock
+    def __init__(self, clock, numberOfChannels=16) -> None:
+        self.clock = clock
+        super().__init__(numberOfChannels)
+
+    def getTimestamp(self):
+        return int(round(self.clock.now() * 1e9))
+
+
+class AudioRenderer:
+    # Synthesizes a recorded command stream with one sine oscillator per DSP voice. Between two
+    # commands the oscillator state is constant, so every segment is computed as one NumPy block.
+    BLOCK_SIZE = 8192
+
+    def __init__(self, sampleRate=44100, numberOfChannels=16) -> None:
+        self.sampleRate = sampleRate
+        self.numberOfChannels = numberOfChannels
+        self.ramp = np.arange(self.BLOCK_SIZE)
+
+    def render(self, commands, duration):
+        # commands: (timestamp in ns, DSPCommands, payload) as recorded by a SimulatedTransport
+        samples = np.zeros(int(np.ceil(duration * self.sampleRate)), dtype=np.float64)
+        frequency = np.zeros(self.numberOfChannels)
+        amplitude = np.zeros(self.numberOfChannels)
+        active = np.zeros(self.numberOfChannels, dtype=bool)
+        phase = np.zeros(self.numberOfChannels)
+        volume = 127
+
+        position = 0
+        for timestamp, command, payload in commands:
+            end = min(int(round(timestamp * self.sampleRate / 1e9)), len(samples))
+            if end > position:
+                self.renderSegment(samples, position, end, frequency, amplitude * volume / 127, active, phase)
+                position = end
+            if command == DSPCommands.StartTone:
+                channel = payload & 0xffff
+                frequency[channel] = (payload >> 16) & 0xffff
+                # the gain of one voice stays below 1024
+                amplitude[channel] = (payload >> 32) / 1024
+                active[channel] = True
+            elif command == DSPCommands.StopTone:
+                active[payload] = False
+            elif command == DSPCommands.SetFrequency:
+                frequency[payload & 0xffff] = payload >> 16
+            elif command == DSPCommands.SetVolume:
+                volume = payload
+            elif command == DSPCommands.Reset:
+                active[:] = False
+        self.renderSegment(samples, position, len(samples), frequency, amplitude * volume / 127, active, phase)
+        return samples
+
+    def renderSegment(self, samples, start, end, frequency, amplitude, active, phase):
+        voices = np.flatnonzero(active)
+        if not len(voices):
+            return
+        increment = 2 * np.pi * frequency[voices] / self.sampleRate
+        for blockStart in range(start, end, self.BLOCK_SIZE):
+            length = min(self.BLOCK_SIZE, end - blockStart)
+            # voices x samples, summed over the voices
+            phases = phase[voices, None] + increment[:, None] * self.ramp[:length]
+            samples[blockStart:blockStart + length] = amplitude[voices] @ np.sin(phases)
+            phase[voices] = (phase[voices] + increment * length) % (2 * np.pi)
+
+    def writeWav(self, samples, path):
+        pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.sampleRate)
+            f.writeframes(pcm.tobytes())
+
+
+def renderTimeline(timeline, path, sampleRate=44100, stealPolicy="oldest", tail=0.5):
+    # Plays a compiled timeline with TimelinePlayer on a clock that does not wait and synthesizes
+    # the commands it emits. Returns the duration of the song in seconds.
+    clock = VirtualClock()
+    transport = OfflineTransport(clock)
+    # the renderer understands SetFrequency, bends glide without restarting the tones
+    chHandler = ChannelHandler(stealPolicy=stealPolicy, transport=transport, threaded=False, setFrequency=True)
+    TimelinePlayer(chHandler, clock).play(timeline)
+    duration = float(timeline["time"][-1]) if len(timeline) else 0.0
+
+    renderer = AudioRenderer(sampleRate, chHandler.maxChNmbr)
+    renderer.writeWav(renderer.render(transport.commands, duration + tail), path)
+    chHandler.close()
+    return duration
+
+
+if __name__ == "__main__":
+    from midi_song import MidiSong
+
+    parser = argparse.ArgumentParser(description="Render midi files to WAV the way the DSP board would play them.")
+    parser.add_argument("files", nargs="+", help="midi files")
+    parser.add_argument("-o", "--output", default=".", help="directory for the WAV files")
+    parser.add_argument("-r", "--rate", type=int, default=44100, help="sample rate")
+    args = parser.parse_args()
+
+    song = MidiSong()
+    for file in args.files:
+        song.open(file)
+        path = os.path.join(args.output, os.path.splitext(os.path.basename(file))[0] + ".wav")
+        duration = renderTimeline(song.getTimeline(), path, args.rate)
+        print("{}: {:.1f} s -> {}".format(file, duration, path))
@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import matplotlib
+matplotlib.use("Agg")
+import mido
+import numpy as np
+
+from dsp_interface import ChannelHandler
+from player import TimelinePlayer, VirtualClock
+from transport import NullTransport
+from preview_image import PreviewImageRenderer
+
+# Times the stages of a file on its way to the board and writes the results as JSON:
+#   python benchmark.py -o before.json
+#   python benchmark.py -o after.json --compare before.json
+STAGES = ("parse", "intervals", "draw", "dispatch")
+
+
+def writeSyntheticFiles(directory):
+    # stress files that are not in the corpus, always generated the same way
+    rng = random.Random(1234)
+    files = []
+
+    def save(name, ticksPerBeat, tracks):
+        midi = mido.MidiFile(ticks_per_beat=ticksPerBeat)
+        for messages in tracks:
+            track = mido.MidiTrack()
+            # messages are (absolute tick, message), stored with delta times
+            now = 0
+            for tick, message in sorted(messages, key=lambda item: item[0]):
+                track.append(message.copy(time=tick - now))
+                now = tick
+            midi.tracks.append(track)
+        path = os.path.join(directory, name + ".mid")
+        midi.save(path)
+        files.append(path)
+
+    # 30 minutes of eighth notes on one channel
+    messages = [(0, mido.MetaMessage("set_tempo", tempo=500000))]
+    for beat in range(3600 * 2):
+        note = 48 + rng.randrange(36)
+        messages.append((beat * 240, mido.Message("note_on", note=note, velocity=80)))
+        messages.append((beat * 240 + 200, mido.Message("note_off", note=note)))
+    save("synthetic-long", 480, [messages])
+
+    # high resolution with tempo changes and pitch bends, 5 minutes
+    ticksPerBeat = 9600
+    messages = []
+    for beat in range(600):
+        tick = beat * ticksPerBeat
+        if beat % 16 == 0:
+            messages.append((tick, mido.MetaMessage("set_tempo", tempo=rng.choice([400000, 500000, 600000]))))
+        for sixteenth in range(4):
+            start = tick + sixteenth * ticksPerBeat // 4
+            note = 60 + rng.randrange(24)
+            messages.append((start, mido.Message("note_on", note=note, velocity=rng.randrange(40, 127))))
+            messages.append((start + ticksPerBeat // 5, mido.Message("note_off", note=note)))
+            messages.append((start + 17, mido.Message("pitchwheel", pitch=rng.randrange(-8192, 8191))))
+    save("synthetic-highppq", ticksPerBeat, [messages])
+
+    # 16 tracks of dense chords, far more notes than voices
+    tracks = []
+    for channel in range(16):
+        messages = []
+        for beat in range(1200):
+            chord = rng.sample(range(36, 96), 6)
+            for note in chord:
+                messages.append((beat * 480, mido.Message("note_on", channel=channel, note=note, velocity=90)))
+                messages.append((beat * 480 + 470, mido.Message("note_off", channel=channel, note=note)))
+        tracks.append(messages)
+    save("synthetic-chords", 480, tracks)
+    return files
+
+
+def dispatch(timeline):
+    # the player loop on a clock that does not wait, into a transport that drops the data
+    chHandler = ChannelHandler(transport=NullTransport(), threaded=False)
+    TimelinePlayer(chHandler, VirtualClock()).play(timeline)
+    chHandler.close()
+
+
+def measure(function, repeat):
+    # best and median wall time of repeat runs, then one more run under tracemalloc for the peak
+    times = []
+    for run in range(repeat):
+        startTime = perf_counter()
+        function()
+        times.append(perf_counter() - startTime)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), float(np.median(times)), peak
+
+
+def benchmarkFile(visualizer, filename, imagePath, stages, repeat):
+    # every stage starts from what the previous ones produced, nothing comes from a cache
+    results = []
+
+    def parse():
+        visualizer.open(filename)
+        visualizer.events, trackCount = visualizer.get_events(filename)
+
+    def intervals():
+        visualizer.getSong().intervals = None
+        return visualizer.getMidiInformation()
+
+    def draw():
+        # the intervals are kept from the stage before, only the rendering is timed
+        visualizer.visualizationFile = imagePath
+        visualizer.draw_midiImage()
+
+    parse()
+    timeline = visualizer.getTimeline()
+    counts = {"parse": len(visualizer.events), "intervals": len(visualizer.events),
+              "draw": len(intervals()), "dispatch": len(timeline)}
+    functions = {"parse": parse, "intervals": intervals, "draw": draw, "dispatch": lambda: dispatch(timeline)}
+    for stage in stages:
+        best, median, peak = measure(functions[stage], repeat)
+        results.append({
+            "file": os.path.basename(filename),
+            "stage": stage,
+            "events": counts[stage],
+            "seconds": best,
+            "medianSeconds": median,
+            "eventsPerSecond": counts[stage] / best if best else 0.0,
+            "peakBytes": peak,
+        })
+    return results
+
+
+def getCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, path):
+    # ratio of the best times, below 1 is faster than the old run
+    with open(path) as f:
+        old = {(result["file"], result["stage"]): result for result in json.load(f)["results"]}
+    for result in results:
+        before = old.get((result["file"], result["stage"]))
+        if before and before["seconds"]:
+            print("{:45} {:10} {:6.2f}x time  {:6.2f}x memory".format(
+                result["file"][:45], result["stage"], result["seconds"] / before["seconds"],
+                result["peakBytes"] / max(before["peakBytes"], 1)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parsing, preview rendering and dispatch.")
+    parser.add_argument("--corpus", default="MIDI-Files", help="directory of midi files")
+    parser.add_argument("--no-synthetic", dest="synthetic", action="store_false", help="skip the generated stress files")
+    parser.add_argument("--stage", action="append", choices=STAGES, help="only these stages (default: all)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument("-o", "--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", metavar="JSON", help="print the ratios to an earlier result file")
+    args = parser.parse_args()
+    stages = args.stage or list(STAGES)
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = sorted(os.path.join(args.corpus, file) for file in os.listdir(args.corpus)
+                       if os.path.splitext(file)[1].lower() == ".mid")
+        if args.synthetic:
+            files += writeSyntheticFiles(directory)
+        visualizer = PreviewImageRenderer()
+        # measure the work itself, not the song cache
+        visualizer.songCache = None
+        visualizer.initFigure()
+        results = []
+        for filename in files:
+            try:
+                results += benchmarkFile(visualizer, filename, os.path.join(directory, "preview.png"), stages, args.repeat)
+            except (OSError, EOFError, ValueError) as e:
+                print("skipped {}: {}".format(filename, str(e) or type(e).__name__), file=sys.stderr)
+
+    report = {
+        "commit": getCommit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,162 @@
+import mmap
+import struct
+import threading
+from time import perf_counter_ns, time_ns
+import numpy as np
+from dsp_interface import UsbWriter, DirectWriter
+from player import PlaybackClock, LatenessStats
+from transport import COMMAND_LENGTHS, DSPCommands
+
+# A command log is a header followed by one fixed size record per command sent to a board:
+#   header: magic, version, record size, wall clock time of the start in ns
+#   record: ns since the start, board index, DSPCommands opcode, payload (the data of sendCommand)
+# Records are little endian and unaligned, RECORD_DTYPE reads them straight from the file.
+LOG_MAGIC = b"DSPCMDS\x00"
+LOG_VERSION = 1
+HEADER = struct.Struct("<8sHHq")
+RECORD = struct.Struct("<qBBQ")
+RECORD_DTYPE = np.dtype([("time", "<i8"), ("board", "u1"), ("command", "u1"), ("payload", "<u8")])
+
+
+class CommandRecorder:
+    # Appends every command to a command log. record() is called from the player thread and
+    # from the GUI (volume), the records are collected under a short lock and written in blocks.
+    def __init__(self, path, bufferSize=1 << 16) -> None:
+        self.path = path
+        self.bufferSize = bufferSize
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        self.count = 0
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(LOG_MAGIC, LOG_VERSION, RECORD.size, time_ns()))
+        self.startTime = perf_counter_ns()
+
+    def record(self, board, command, payload):
+        record = RECORD.pack(perf_counter_ns() - self.startTime, board, command.value, payload)
+        with self.lock:
+            self.buffer += record
+            self.count += 1
+            if len(self.buffer) >= self.bufferSize:
+                self.file.write(self.buffer)
+                self.buffer = bytearray()
+
+    def close(self):
+        with self.lock:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+            self.file.close()
+
+
+class CommandLog:
+    # A command log mapped into memory, records is a structured array on the mapping, nothing is
+    # parsed or copied. A record cut off at the end (recording was killed) is ignored.
+    def __init__(self, path) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER.size:
+            self.mmap.close()
+            raise ValueError("Not a command log: " + path)
+        magic, version, recordSize, self.startTime = HEADER.unpack_from(self.mmap)
+        if magic != LOG_MAGIC or version != LOG_VERSION or recordSize != RECORD_DTYPE.itemsize:
+            self.mmap.close()
+            raise ValueError("Not a command log of version {}: {}".format(LOG_VERSION, path))
+        count = (len(self.mmap) - HEADER.size) // recordSize
+        self.records = np.frombuffer(self.mmap, RECORD_DTYPE, count, HEADER.size)
+
+    def __len__(self):
+        return len(self.records)
+
+    def getBoardCount(self):
+        return int(self.records["board"].max()) + 1 if len(self.records) else 0
+
+    def getDuration(self):
+        # seconds between the first and the last command
+        if not len(self.records):
+            return 0.0
+        return (int(self.records["time"][-1]) - int(self.records["time"][0])) / 1e9
+
+    def close(self):
+        # the array has to go before the mapping can be closed
+        self.records = None
+        self.mmap.close()
+
+
+class CommandReplayer:
+    # Sends the commands of a CommandLog to one transport per board again, either with the
+    # recorded timing (same clock as the TimelinePlayer) or as fast as possible. framing packs
+    # the commands due at the same time into one transfer per board, like DSPInterface.flush.
+    # stop() may be called from any thread.
+    def __init__(self, transports, framing=False, threaded=True) -> None:
+        self.transports = list(transports)
+        self.framing = framing
+        self.writers = [UsbWriter(transport) if threaded else DirectWriter(transport) for transport in self.transports]
+        self.clock = PlaybackClock()
+        self.stats = LatenessStats()
+        self.wakeUp = threading.Event()
+        self.commands = 0
+        self.seconds = 0.0
+
+    def stop(self):
+        self.wakeUp.set()
+
+    def play(self, log, realtime=True):
+        if log.getBoardCount() > len(self.writers):
+            raise ValueError("The log needs {} boards, {} given".format(log.getBoardCount(), len(self.writers)))
+        records = log.records
+        count = len(records)
+        times = ((records["time"] - records["time"][0]) / 1e9).tolist() if count else []
+        boards = records["board"].tolist()
+        commands = records["command"].tolist()
+        payloads = records["payload"].tolist()
+        # bytes of every opcode, the same encoding as DSPInterface.encodeCommand
+        lengths = {command.value: COMMAND_LENGTHS[command] + 2 for command in DSPCommands}
+        frames = [bytearray() for writer in self.writers]
+        maxPacketSizes = [transport.maxPacketSize for transport in self.transports]
+        self.stats.reset(count)
+        self.wakeUp.clear()
+        index = 0
+        due = float("inf")
+        self.clock.start()
+        while index < count:
+            if realtime:
+                lateness = self.clock.waitUntil(times[index], self.wakeUp)
+                if lateness is None:
+                    break
+                self.stats.add(lateness)
+                due = self.clock.now()
+            # everything that is due goes out now, as fast as possible that is the whole log,
+            # so stop() is checked every 256 records
+            while index < count and times[index] <= due:
+                if index & 0xff == 0 and self.wakeUp.is_set():
+                    break
+                board = boards[index]
+                data = (commands[index] + (payloads[index] << 16)).to_bytes(lengths[commands[index]], 'little')
+                if not self.framing:
+                    self.writers[board].put(data)
+                else:
+                    if len(frames[board]) + len(data) > maxPacketSizes[board]:
+                        self.writers[board].put(bytes(frames[board]))
+                        frames[board] = bytearray()
+                    frames[board] += data
+                index += 1
+            for board, frame in enumerate(frames):
+                if frame:
+                    self.writers[board].put(bytes(frame))
+                    frames[board] = bytearray()
+            if self.wakeUp.is_set():
+                break
+        self.commands = index
+        self.seconds = self.clock.now()
+        return "Finished" if index == count else "Stopped"
+
+    def getReport(self):
+        lines = ["Replayed {} commands in {:.2f} s ({:.0f} commands/s)".format(
+            self.commands, self.seconds, self.commands / self.seconds if self.seconds else 0.0)]
+        if self.stats.count:
+            lines.append(self.stats.getReport())
+        return "\n".join(lines)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
@@ -1,119 +1,298 @@
-import usb
-import usb.core
-import usb.util
-import libusb_package
-from FrequencyHandler import FrequencyHandler
-from enum import Enum
-
-class DSPCommands(Enum):
-    StartTone = 1
-    StopTone = 2
-    Reset = 3
-    SetVolume = 4
+import os
+import threading
+from collections import deque
+from FrequencyHandler import FrequencyHandler, BEND_CENTER
+from voice_allocator import VoiceAllocator
+from transport import DSPCommands, UsbTransport, findUsbTransports
+from time import perf_counter_ns
+from tracer import ALLOCATE, QUEUE, SEND, WRITE
+
+# oscillators of one DSP board
+VOICES_PER_BOARD = 16
+# optional per note frequencies that replace the generated ones
+FREQUENCY_FILE = "data/freq.txt"
+
+class UsbWriter:
+    # The only thread that touches the transport. Callers append to a bounded deque (append and
+    # popleft are atomic) and never wait for USB, a full queue drops the data and counts it.
+    def __init__(self, transport, maxQueueSize=1024) -> None:
+        self.transport = transport
+        self.maxQueueSize = maxQueueSize
+        self.queue = deque()
+        self.wakeup = threading.Event()
+        self.running = True
+        # statistics
+        self.written = 0
+        self.overflows = 0
+        self.errors = 0
+        self.maxDepth = 0
+        # optional tracer.Tracer, set by ChannelHandler.setTracer
+        self.tracer = None
+        self.thread = threading.Thread(target=self.run, name="UsbWriter", daemon=True)
+        self.thread.start()
+
+    def put(self, data):
+        depth = len(self.queue)
+        if depth >= self.maxQueueSize:
+            self.overflows += 1
+            return False
+        # traced transfers carry the time they were queued
+        self.queue.append(data if self.tracer is None else (perf_counter_ns(), data))
+        self.maxDepth = max(self.maxDepth, depth + 1)
+        self.wakeup.set()
+        return True
+
+    def clear(self):
+        self.queue.clear()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while self.queue:
+                data = self.queue.popleft()
+                tracer = self.tracer
+                if type(data) is tuple:
+                    queuedAt, data = data
+                    if tracer is not None:
+                        tracer.record(QUEUE, queuedAt)
+                start = perf_counter_ns() if tracer is not None else 0
+                try:
+                    self.transport.write(data)
+                    self.written += 1
+                except IOError:
+                    self.errors += 1
+                if tracer is not None:
+                    tracer.record(WRITE, start, value=len(data))
+
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.transport.close()
+
+    def getStats(self):
+        return {"written": self.written, "queued": len(self.queue), "maxDepth": self.maxDepth,
+                "overflows": self.overflows, "errors": self.errors}
+
+
+class DirectWriter:
+    # same interface as UsbWriter but writes in the calling thread, for offline rendering
+    def __init__(self, transport) -> None:
+        self.transport = transport
+        self.written = 0
+        self.errors = 0
+        self.tracer = None
+
+    def put(self, data):
+        start = perf_counter_ns() if self.tracer is not None else 0
+        try:
+            self.transport.write(data)
+            self.written += 1
+        except IOError:
+            self.errors += 1
+        if self.tracer is not None:
+            self.tracer.record(WRITE, start, value=len(data))
+        return True
+
+    def clear(self):
+        pass
+
+    def close(self):
+        self.transport.close()
+
+    def getStats(self):
+        return {"written": self.written, "queued": 0, "maxDepth": 0, "overflows": 0, "errors": self.errors}
+
 
 class DSPInterface:
-    def __init__(self, numberOfChannels) -> None:
+    # framing: pack all commands until flush() into one bulk write (firmware has to split them
+    # again by their opcode), without it every command is written on its own
+    # transport: where the commands go, by default the DSP board on USB (see transport.py)
+    # threaded: write from a background thread, otherwise synchronously in the calling thread
+    # freqHandler: note -> frequency table, by default equal temperament with data/freq.txt applied
+    def __init__(self, numberOfChannels, framing=False, transport=None, threaded=True, freqHandler=None) -> None:
         self.currentTones = [0] * numberOfChannels
-        self.freqHandler = FrequencyHandler("data/freq.txt")
-        self.initUsb()
+        if freqHandler is None:
+            freqHandler = FrequencyHandler(FREQUENCY_FILE if os.path.exists(FREQUENCY_FILE) else None)
+        self.freqHandler = freqHandler
+        self.framing = framing
+        self.frame = bytearray()
+        self.transport = transport if transport is not None else UsbTransport()
+        self.maxPacketSize = self.transport.maxPacketSize
+        # all transfers go through the writer thread
+        self.writer = UsbWriter(self.transport) if threaded else DirectWriter(self.transport)
+        self.tracer = None
+        # optional command_log.CommandRecorder and the index of this board in its records
+        self.recorder = None
+        self.board = 0
         self.resetDSP()
         
-    def initUsb(self):
-        be = libusb_package.get_libusb1_backend()
-
-        for dev in libusb_package.find(find_all=True):
-            pass
-            
-        # find our device
-        self.dev = usb.core.find(idVendor=0x0c55, idProduct=0x1234)
-
-        # was it found?
-        if self.dev is None:
-            raise ValueError('Device not found')
-
-        # set the active configuration. With no arguments, the first
-        # configuration will be the active one
-        self.dev.set_configuration()
-
-        # get an endpoint instance
-        cfg = self.dev.get_active_configuration()
-        intf = cfg[(0,0)]
-
-        self.ep = usb.util.find_descriptor(
-            intf,
-            # match the first OUT endpoint
-            custom_match = \
-            lambda e: \
-                usb.util.endpoint_direction(e.bEndpointAddress) == \
-                usb.util.ENDPOINT_OUT)
-
-    def startTone(self, tone, gain, channel):
-        frequency = self.freqHandler.getFrequency(tone)
+    def startTone(self, tone, gain, channel, bend=BEND_CENTER):
+        frequency = self.freqHandler.getFrequency(tone, bend)
         data = channel + (frequency << 16) + (int(gain) << 32)
         self.sendCommand(DSPCommands.StartTone, data, 6)
+
+    def setFrequency(self, tone, bend, channel):
+        # retune a sounding tone, used for pitch bends
+        frequency = self.freqHandler.getFrequency(tone, bend)
+        data = channel + (frequency << 16)
+        self.sendCommand(DSPCommands.SetFrequency, data, 4)
         
     def stopTone(self, channel):
         data = channel
         self.sendCommand(DSPCommands.StopTone, data, 2)
         
     def setVolume(self, volume):
+        # called from the GUI thread, bypasses the frame of the player thread
         data = volume
-        self.sendCommand(DSPCommands.SetVolume, data, 2)
+        if self.recorder is not None:
+            self.recorder.record(self.board, DSPCommands.SetVolume, data)
+        self.writer.put(self.encodeCommand(DSPCommands.SetVolume, data, 2))
 
     def resetDSP(self):
-        self.sendCommand(DSPCommands.Reset, 0, 0)
+        # pending commands are obsolete after a reset, which is always sent right away
+        self.frame = bytearray()
+        self.writer.clear()
+        if self.recorder is not None:
+            self.recorder.record(self.board, DSPCommands.Reset, 0)
+        self.writer.put(self.encodeCommand(DSPCommands.Reset, 0, 0))
 
-    def sendCommand(self, command, data, dataLength):
+    def encodeCommand(self, command, data, dataLength):
         out = command.value + (data << 16)
-        self.ep.write(out.to_bytes(dataLength + 2,'little'))
+        return out.to_bytes(dataLength + 2,'little')
+
+    def sendCommand(self, command, data, dataLength):
+        start = perf_counter_ns() if self.tracer is not None else 0
+        if self.recorder is not None:
+            self.recorder.record(self.board, command, data)
+        out = self.encodeCommand(command, data, dataLength)
+        if not self.framing:
+            self.writer.put(out)
+        else:
+            # a frame never exceeds one packet of the endpoint
+            if len(self.frame) + len(out) > self.maxPacketSize:
+                self.flush()
+            self.frame += out
+        if self.tracer is not None:
+            self.tracer.record(SEND, start, value=len(out))
+
+    def flush(self):
+        # hand all commands collected since the last flush to the writer as one transfer
+        frame, self.frame = self.frame, bytearray()
+        if frame:
+            self.writer.put(bytes(frame))
+
+    def close(self):
+        self.writer.close()
 
 class ChannelHandler:
-    def __init__(self) -> None:
-        self.maxChNmbr = 16
-        self.volume = int(1023/16)
+    # Plays midi notes on the voices of one or more DSP boards, all boards form one voice pool.
+    # transport: a transport or a list of them (one per board), by default every board on USB
+    # setFrequency: follow pitch bends with the SetFrequency command, the firmware has to
+    # support it. Without it pitch bends are ignored and every tone plays unbent.
+    def __init__(self, framing=False, stealPolicy="oldest", transport=None, threaded=True, freqHandler=None,
+                 setFrequency=False) -> None:
+        if transport is None:
+            transports = findUsbTransports()
+        elif isinstance(transport, (list, tuple)):
+            transports = list(transport)
+        else:
+            transports = [transport]
+        self.maxChNmbr = VOICES_PER_BOARD * len(transports)
+        # the gain of the voices of one board adds up to 1023
+        self.volume = int(1023/VOICES_PER_BOARD)
         #self.volume = 1
-        self.tones = {} # format: tone:channel
-        
-        self.dspInterface = DSPInterface(self.maxChNmbr)
+        self.voices = VoiceAllocator(self.maxChNmbr, stealPolicy, groupSize=VOICES_PER_BOARD)
+        # current pitch bend of every midi channel
+        self.bends = [BEND_CENTER] * 16
+        self.setFrequency = setFrequency
+
+        # voice v plays on channel v % VOICES_PER_BOARD of board v // VOICES_PER_BOARD
+        self.dspInterfaces = [DSPInterface(VOICES_PER_BOARD, framing, boardTransport, threaded, freqHandler)
+                              for boardTransport in transports]
+        for board, dspInterface in enumerate(self.dspInterfaces):
+            dspInterface.board = board
+        self.dspInterface = self.dspInterfaces[0]
+        self.tracer = None
 
+    def setTracer(self, tracer):
+        # record allocation, commands and transfers into a tracer.Tracer, None switches it off
+        self.tracer = tracer
+        for dspInterface in self.dspInterfaces:
+            dspInterface.tracer = tracer
+            dspInterface.writer.tracer = tracer
 
-    def getKey(self, tone, channel):
-        return str(tone) + "_" + str(channel)
+    def setRecorder(self, recorder):
+        # log every command into a command_log.CommandRecorder, None switches it off
+        for dspInterface in self.dspInterfaces:
+            dspInterface.recorder = recorder
+
+    def getBoardCount(self):
+        return len(self.dspInterfaces)
 
     def startTone(self, tone, velocity, midiChannel):
-        #select channel to use for tone
-        for index in range(self.maxChNmbr):
-            if index not in self.tones.values():
-
-                if tone not in self.tones.keys():
-                    # Channel free and tone not already played
-                    key = self.getKey(tone, midiChannel)
-                    self.tones[key] = index
-                    break
-
-                else:
-                    # tone already played
-                    print("Tone already active")
-                    return
+        #select channel to use for tone, a busy one is stolen if needed
+        if self.tracer is not None:
+            start = perf_counter_ns()
+            voice = self.voices.allocate(tone, midiChannel, velocity)
+            self.tracer.record(ALLOCATE, start)
         else:
+            voice = self.voices.allocate(tone, midiChannel, velocity)
+        if voice is None:
             # all channels are busy
-            print("All channels busy")
             return
 
-        channel = index
-        
-        # send start Tone on channel index
+        # send start Tone on the channel of the voice
         gain = self.volume * velocity / 127
-        self.dspInterface.startTone(tone, gain, channel)
+        self.dspInterfaces[voice // VOICES_PER_BOARD].startTone(tone, gain, voice % VOICES_PER_BOARD, self.bends[midiChannel])
 
     def stopTone(self, tone, midiChannel):
-        key = self.getKey(tone, midiChannel)
-        if key in self.tones.keys():
-            channel = self.tones.pop(key)
-
+        voice = self.voices.release(tone, midiChannel)
+        if voice is not None:
             #send stop Tone
-            self.dspInterface.stopTone(channel)
-        
-        
+            self.dspInterfaces[voice // VOICES_PER_BOARD].stopTone(voice % VOICES_PER_BOARD)
+
+    def pitchBend(self, bend, midiChannel):
+        # retune all sounding tones of the midi channel, later tones start bent
+        if not self.setFrequency or bend == self.bends[midiChannel]:
+            return
+        self.bends[midiChannel] = bend
+        for key, voice in self.voices.active.items():
+            if key >> 7 == midiChannel:
+                self.dspInterfaces[voice // VOICES_PER_BOARD].setFrequency(key & 0x7F, bend, voice % VOICES_PER_BOARD)
+
+    def releaseAll(self):
+        # stop the tones still sounding and center the bends, the boards are not reset
+        for key, voice in list(self.voices.active.items()):
+            self.stopTone(key & 0x7F, key >> 7)
+        self.bends = [BEND_CENTER] * 16
+        self.flush()
+
+    def resetDSP(self):
+        # silence the boards and forget all sounding tones
+        self.voices.reset()
+        self.bends = [BEND_CENTER] * 16
+        for dspInterface in self.dspInterfaces:
+            dspInterface.resetDSP()
+
     def setVolume(self, volume):
-        self.dspInterface.setVolume(volume)
+        for dspInterface in self.dspInterfaces:
+            dspInterface.setVolume(volume)
+
+    def flush(self):
+        # send everything due at the current timestamp
+        for dspInterface in self.dspInterfaces:
+            dspInterface.flush()
+
+    def getWriterStats(self):
+        # writer statistics summed over all boards
+        stats = {}
+        for dspInterface in self.dspInterfaces:
+            for name, value in dspInterface.writer.getStats().items():
+                stats[name] = max(stats.get(name, 0), value) if name == "maxDepth" else stats.get(name, 0) + value
+        return stats
+
+    def close(self):
+        for dspInterface in self.dspInterfaces:
+            dspInterface.close()
@@ -0,0 +1,211 @@
+import argparse
+import os
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+
+from midi_song import MidiSong
+from song_cache import SongCache
+
+# Command line entry point without Qt:
+#   python headless.py play <files or playlists>   play through the DSP board (or --simulate)
+#   python headless.py previews <directory>        render all missing previews on every core
+#   python headless.py replay <log>                 send a command log (play --record) again
+
+
+def readPlaylist(paths):
+    # expands playlist files (.m3u/.txt, one midi file per line, '#' starts a comment)
+    files = []
+    for path in paths:
+        name, ext = os.path.splitext(path)
+        if ext.lower() in (".m3u", ".txt"):
+            with open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        files.append(os.path.join(os.path.dirname(path), line))
+        else:
+            files.append(path)
+    return files
+
+
+def loadSong(songCache, filename):
+    song = MidiSong(songCache)
+    song.open(filename)
+    song.getTimeline()
+    return song
+
+
+def play(args):
+    from dsp_interface import ChannelHandler
+    from FrequencyHandler import FrequencyHandler
+    from player import TimelinePlayer
+    from transport import SimulatedTransport
+
+    transport = [SimulatedTransport() for board in range(args.boards)] if args.simulate else None
+    try:
+        # without options the board keeps the default table (data/freq.txt)
+        freqHandler = None
+        if args.tuning != "equal" or args.reference != 440.0:
+            freqHandler = FrequencyHandler(None, args.reference, args.tuning)
+        chHandler = ChannelHandler(framing=args.framing, stealPolicy=args.policy, transport=transport, freqHandler=freqHandler,
+                                   setFrequency=args.set_frequency)
+    except ValueError as e:
+        print("No DSP-Board detected:", e)
+        return 1
+    player = TimelinePlayer(chHandler)
+    tracer = None
+    if args.trace:
+        from tracer import Tracer
+        tracer = Tracer()
+        chHandler.setTracer(tracer)
+        player.tracer = tracer
+    recorder = None
+    if args.record:
+        from command_log import CommandRecorder
+        recorder = CommandRecorder(args.record)
+        chHandler.setRecorder(recorder)
+    # Ctrl+C stops the current track and the playlist
+    signal.signal(signal.SIGINT, lambda signum, frame: player.stop())
+
+    # files played before (also by the GUI) are not parsed again
+    songCache = SongCache(directory="data/songs")
+    files = readPlaylist(args.files)
+    # the next file is parsed and compiled while the current one plays
+    prefetch = ThreadPoolExecutor(max_workers=1)
+    pending = prefetch.submit(loadSong, songCache, files[0]) if files else None
+    continueAt = None
+    player.start()
+    for index, file in enumerate(files):
+        try:
+            song = pending.result()
+        except (OSError, EOFError, ValueError) as e:
+            print("Error opening " + file + ": " + (str(e) or type(e).__name__))
+            song = None
+        # Ctrl+C while waiting for the file
+        if player.is_stopped:
+            break
+        pending = prefetch.submit(loadSong, songCache, files[index + 1]) if index + 1 < len(files) else None
+        if song is None:
+            continueAt = None
+            continue
+        print("Playing " + file)
+        result = player.play(song.getTimeline(), position=args.start, continueAt=continueAt)
+        print(player.stats.getReport())
+        if result == "Stopped":
+            break
+        # gapless: the next file starts on the clock deadline this one ends on
+        continueAt = song.getDuration() if not args.start else None
+    prefetch.shutdown(cancel_futures=True)
+    chHandler.close()
+    if tracer is not None:
+        print(tracer.getReport())
+        tracer.writeChromeTrace(args.trace)
+        print("Trace written to " + args.trace)
+    if recorder is not None:
+        recorder.close()
+        print("{} commands recorded to {}".format(recorder.count, args.record))
+    return 0
+
+
+def replay(args):
+    from command_log import CommandLog, CommandReplayer
+    from transport import SimulatedTransport, findUsbTransports
+
+    try:
+        log = CommandLog(args.log)
+    except (OSError, ValueError) as e:
+        print("Error opening " + args.log + ": " + str(e))
+        return 1
+    boards = max(log.getBoardCount(), 1)
+    try:
+        transports = [SimulatedTransport() for board in range(boards)] if args.simulate else findUsbTransports()
+    except ValueError as e:
+        print("No DSP-Board detected:", e)
+        return 1
+    # as fast as possible the transfers are written synchronously, a queue would only overflow
+    replayer = CommandReplayer(transports, framing=args.framing, threaded=not args.fast)
+    signal.signal(signal.SIGINT, lambda signum, frame: replayer.stop())
+    print("Replaying {} commands of {:.2f} s on {} board(s)".format(len(log), log.getDuration(), boards))
+    try:
+        replayer.play(log, realtime=not args.fast)
+    except ValueError as e:
+        print(e)
+        return 1
+    finally:
+        replayer.close()
+        log.close()
+    print(replayer.getReport())
+    if args.simulate:
+        for board, transport in enumerate(transports):
+            stats = transport.getStats()
+            print("Board {}: {} commands in {} transfers, {} bytes".format(board, stats["commands"], stats["transfers"], stats["bytes"]))
+    return 0
+
+
+def renderPreview(filename):
+    # runs in a worker process, every process keeps its own figure
+    global previewVisualizer
+    if "previewVisualizer" not in globals():
+        import matplotlib
+        matplotlib.use("Agg")
+        from preview_image import PreviewImageRenderer
+        previewVisualizer = PreviewImageRenderer()
+        previewVisualizer.initFigure()
+    startTime = perf_counter()
+    try:
+        previewVisualizer.renderPreview(filename)
+    except Exception as e:
+        return filename, str(e) or type(e).__name__, perf_counter() - startTime
+    return filename, None, perf_counter() - startTime
+
+
+def previews(args):
+    files = sorted(os.path.join(args.directory, file) for file in os.listdir(args.directory)
+                   if os.path.splitext(file)[1].lower() == ".mid")
+    failed = 0
+    startTime = perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for filename, error, duration in pool.map(renderPreview, files):
+            if error is None:
+                print("{:6.2f} s  {}".format(duration, filename))
+            else:
+                failed += 1
+                print("failed    {}: {}".format(filename, error))
+    print("{} previews in {:.2f} s, {} failed".format(len(files), perf_counter() - startTime, failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play midi files on the DSP board without the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    playParser = commands.add_parser("play", help="play midi files or playlists")
+    playParser.add_argument("files", nargs="+", help="midi files or playlists (.m3u/.txt)")
+    playParser.add_argument("--simulate", action="store_true", help="use the simulated board instead of USB")
+    playParser.add_argument("--boards", type=int, default=1, help="number of simulated boards")
+    playParser.add_argument("--framing", action="store_true", help="pack commands of one timestamp into one transfer")
+    playParser.add_argument("--policy", default="oldest", choices=["oldest", "quietest", "channel", "none"], help="voice stealing policy")
+    playParser.add_argument("--start", type=float, default=0.0, help="start every file at this position in seconds")
+    playParser.add_argument("--tuning", default="equal", choices=["equal", "just", "pythagorean"], help="tuning system")
+    playParser.add_argument("--reference", type=float, default=440.0, help="frequency of A4 in Hz")
+    playParser.add_argument("--set-frequency", action="store_true", help="follow pitch bends with SetFrequency (needs firmware support), ignored otherwise")
+    playParser.add_argument("--trace", metavar="FILE", help="record the playback path and write a Chrome trace JSON")
+    playParser.add_argument("--record", metavar="FILE", help="log every command sent to the boards into a binary file")
+    playParser.set_defaults(run=play)
+
+    replayParser = commands.add_parser("replay", help="send the commands of a log recorded with play --record again")
+    replayParser.add_argument("log", help="command log")
+    replayParser.add_argument("--simulate", action="store_true", help="use simulated boards instead of USB")
+    replayParser.add_argument("--fast", action="store_true", help="as fast as possible instead of the recorded timing")
+    replayParser.add_argument("--framing", action="store_true", help="pack commands due at the same time into one transfer")
+    replayParser.set_defaults(run=replay)
+
+    previewParser = commands.add_parser("previews", help="render the previews of all midi files in a directory")
+    previewParser.add_argument("directory", nargs="?", default="MIDI-Files")
+    previewParser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    previewParser.set_defaults(run=previews)
+
+    args = parser.parse_args()
+    sys.exit(args.run(args))
@@ -0,0 +1,36 @@
+import threading
+from collections import deque
+from time import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+
+class LogBuffer:
+    # Log records (time, level, message) from any thread. add() only appends under a short lock,
+    # the GUI takes the pending records in batches with drain(). Records beyond maxPending push
+    # out the oldest pending ones, drain() reports how many were lost.
+    def __init__(self, maxPending=1000) -> None:
+        self.lock = threading.Lock()
+        self.pending = deque(maxlen=maxPending)
+        self.dropped = 0
+
+    def add(self, message, level=INFO):
+        record = (time(), level, message)
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(record)
+
+    def drain(self):
+        # all records added since the last call, oldest first, plus a warning if some were dropped
+        with self.lock:
+            records = list(self.pending)
+            self.pending.clear()
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            records.append((time(), WARNING, "{} log messages dropped".format(dropped)))
+        return records
@@ -1,4 +1,5 @@
-from time import time
+from time import time, perf_counter
+startupTime = perf_counter()
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
@@ -7,36 +8,30 @@ from datetime import datetime
 import os
 import sys
 
-from visualizer import MidiVisualizer
-from matplotlib.backends.backend_qtagg import (FigureCanvas,  NavigationToolbar2QT as NavigationToolbar)
-from mido import MidiFile
-from dsp_interface import ChannelHandler
+# matplotlib, mido and pyusb are imported on first use, after the window is shown
 from multithread import Worker
+from log_buffer import LogBuffer, INFO, WARNING, ERROR, LEVEL_NAMES
 
 class MainWindow(QMainWindow):
-
+    # emitted by the player thread when the playlist moves on to the file at this index
+    trackChanged = pyqtSignal(int)
 
     def __init__(self, *args, **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
         uic.loadUi(os.path.join(os.path.dirname(__file__), "data/layout.ui"), self) # Load the .ui file
-        # setup and load Midi Visualizer Widget
-        self.initFileList()
+        # worker threads only push into the log buffer, the GUI shows new records in batches
+        self.logBuffer = LogBuffer()
+        self.logLevel = INFO
+        self.logOutput.document().setMaximumBlockCount(2000)
+        self.logTimer = QTimer(self)
+        self.logTimer.setInterval(100)
+        self.logTimer.timeout.connect(self.drainLog)
+        self.logTimer.start()
+        self.midVis = None
+        self.chHandler = None
+        self.fileList = []
+        self.firstPreviewShown = False
         self.cbMidiFile.activated.connect(self.selectedFileChanged)
-        self.midVis = MidiVisualizer()
-        self.canvas = FigureCanvas(self.midVis.initFigure())
-        self.canvas.setStyleSheet("background-color:transparent;")
-        self.toolbar = NavigationToolbar(self.canvas, self)
-        self.toolbar.setVisible(False)
-        layout = QVBoxLayout()
-        layout.addWidget(self.toolbar)
-        self.scrollArea = QScrollArea(self.midoVisualizerWidget)
-        self.scrollArea.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.scrollArea.setAlignment(Qt.AlignLeft)
-        self.scrollArea.setWidget(self.canvas)
-        self.scrollArea.widgetResizable = True
-        self.scrollArea.setVisible(False)
-        layout.addWidget(self.scrollArea)
-        self.midoVisualizerWidget.setLayout(layout)
         # connections between buttons
         self.buttonOpenFile.clicked.connect(self.openNewFile) 
         self.buttonPlay.clicked.connect(self.playTrack)
@@ -45,45 +40,117 @@ class MainWindow(QMainWindow):
         self.adjustVolume.setMaximum(127)
         self.adjustVolume.setValue(120)
         self.adjustVolume.valueChanged.connect(self.setVolume)
+        # A-B loop: first click sets A, second sets B and starts looping, third ends the loop
+        self.buttonLoop = QPushButton("A-B")
+        self.buttonLoop.clicked.connect(self.setLoopPoint)
+        self.horizontalLayout.addWidget(self.buttonLoop)
+        self.loopStart = None
+        # playlist mode: the next file of the list is prefetched and follows without a gap
+        self.checkPlaylist = QCheckBox("Playlist")
+        self.checkPlaylist.toggled.connect(self.setPlaylist)
+        self.horizontalLayout.addWidget(self.checkPlaylist)
+        self.playlist = False
+        self.playingIndex = 0
+        self.prefetched = None
+        self.trackChanged.connect(self.showPlaylistTrack)
+        # a click on the progress bar seeks there, before playing it sets the start position
+        self.startPosition = 0.0
+        self.progressBar.installEventFilter(self)
+        # the playhead follows the playback clock at about 30 frames per second
+        self.playheadTimer = QTimer(self)
+        self.playheadTimer.setInterval(33)
+        self.playheadTimer.timeout.connect(self.updatePlayhead)
         # load default values
         self.progressBar.setRange(0,0)
-        self.is_stopped = False
         # show main Window
         self.duration = 1
         self.startTime = time()
         self.show()
+        self.logStartupPhase("window shown")
         self.threadpool = QThreadPool()
         self.initChannelHandler()
         # disable all buttons to prevent failiure 
         self.buttonPlay.setEnabled(False)
         self.buttonStop.setEnabled(False)
+        self.buttonOpenFile.setEnabled(False)
+        # setup and load Midi Visualizer Widget once the window is painted
+        QTimer.singleShot(0, self.initVisualizer)
+
+    def logStartupPhase(self, phase):
+        self.updateLog("Startup: {} after {:.0f} ms".format(phase, (perf_counter() - startupTime) * 1000))
+
+    def initVisualizer(self):
+        from visualizer import MidiVisualizer
+        from preview_widget import PreviewWidget
+        self.midVis = MidiVisualizer()
+        # the preview renders only the tiles scrolled into view
+        self.preview = PreviewWidget()
+        layout = QVBoxLayout()
+        self.scrollArea = QScrollArea(self.midoVisualizerWidget)
+        self.scrollArea.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.scrollArea.setAlignment(Qt.AlignLeft)
+        self.scrollArea.setWidget(self.preview)
+        self.scrollArea.setVisible(False)
+        layout.addWidget(self.scrollArea)
+        self.midoVisualizerWidget.setLayout(layout)
+        self.logStartupPhase("visualizer ready")
+        self.initFileList()
+        self.buttonOpenFile.setEnabled(True)
+        self.logStartupPhase("file list ready")
+        # the first preview is loaded by a worker thread
+        if self.fileList:
+            self.selectedFileChanged()
 
     def initChannelHandler(self):
-        try:
-            self.chHandler = ChannelHandler()
-            self.updateLog("Connection to DSP-Board established.")
-        except ValueError:
-            reply = QMessageBox.critical(self, 'Error', 'No DSP-Boad detected, retry?', QMessageBox.Retry | QMessageBox.Abort, QMessageBox.Abort)
-            if reply == QMessageBox.Retry:
-                self.initChannelHandler()
-            else:
-                sys.exit()
+        # USB discovery runs in the background, the window stays usable meanwhile
+        worker = Worker(self.connectChannelHandler)
+        worker.signals.result.connect(self.channelHandlerReady)
+        worker.signals.error.connect(self.channelHandlerFailed)
+        self.threadpool.start(worker)
+
+    def connectChannelHandler(self, progress_callback):
+        from dsp_interface import ChannelHandler
+        return ChannelHandler()
+
+    def channelHandlerReady(self, chHandler):
+        from player import TimelinePlayer
+        self.chHandler = chHandler
+        self.player = TimelinePlayer(self.chHandler)
+        self.logStartupPhase("DSP-Board connected")
+        self.updateLog("Connection to DSP-Board established.")
+        if chHandler.getBoardCount() > 1:
+            self.updateLog("{} DSP-Boards, {} voices".format(chHandler.getBoardCount(), chHandler.maxChNmbr))
+
+    def channelHandlerFailed(self, error):
+        exctype, value, trace = error
+        if exctype is not ValueError:
+            self.updateLog("USB error: " + str(value), ERROR)
+        reply = QMessageBox.critical(self, 'Error', 'No DSP-Boad detected, retry?', QMessageBox.Retry | QMessageBox.Abort, QMessageBox.Abort)
+        if reply == QMessageBox.Retry:
+            self.initChannelHandler()
+        else:
+            sys.exit()
 
     def initFileList(self):
         self.fileList = []
+        # files with a cached preview, the sidecar knows which midi file it belongs to
+        filePaths = [info["source"] for key, info in self.midVis.previewCache.entries()]
+        # files opened in the tiled preview are only in the song cache
+        filePaths += [info["source"] for key, info in self.midVis.songCache.entries()]
+        # previews named after their midi file (from before the preview cache)
         for file in os.listdir(os.path.abspath('data/previews')):
             name, ext = os.path.splitext(file)
             if ext == '.png':
-                filePath = "MIDI-Files/" + name + ".mid"
-                if os.path.exists(filePath):
-                    self.fileList.append(filePath)
-                    self.cbMidiFile.addItem(os.path.basename(name) + ".mid")
-                    self.cbMidiFile.setCurrentText(os.path.basename(name) + ".mid")
-        self.cbMidiFile.activated.emit(1)
+                filePaths.append("MIDI-Files/" + name + ".mid")
+        for filePath in filePaths:
+            if os.path.exists(filePath) and filePath not in self.fileList:
+                self.fileList.append(filePath)
+                self.cbMidiFile.addItem(os.path.basename(filePath))
+                self.cbMidiFile.setCurrentText(os.path.basename(filePath))
 
 
     def selectedFileChanged(self):
-            self.midVis.clearAll()
+            self.preview.clear()
             self.hideMidiFile()
             self.progressBar.show()
             self.filename = self.fileList[self.cbMidiFile.currentIndex()]
@@ -96,19 +163,31 @@ class MainWindow(QMainWindow):
 
     def loadFileThread(self, progress_callback):
             try:
-                trackCount = self.midVis.loadFile(self.filename)
+                # no image is rendered here, the preview draws its tiles from the note intervals
+                trackCount = self.midVis.loadSong(self.filename)
             except:
-                self.updateLog("Error opening " + self.filename)
+                self.updateLog("Error opening " + self.filename, ERROR)
                 self.cbMidiFile.removeItem(self.cbMidiFile.count() - 1)
                 self.cbMidiFile.setCurrentIndex(self.cbMidiFile.count()-1)
                 self.fileList.pop()
             else:
                 self.updateLog("Opening " + self.filename)
-                figureSize = self.midVis.getSizeInPixels()
-                self.canvas.resize(figureSize[0]-50,figureSize[1])
 
     def showMidiFile(self):
+        song = self.midVis.getSong()
+        if song.info is None:
+            return
+        self.preview.setSong(song.intervals, song.info)
+        self.scrollArea.horizontalScrollBar().setValue(0)
         self.scrollArea.setVisible(True)
+        # a new file starts from the beginning without a loop
+        self.progressBar.setRange(0, max(int(self.midVis.getDuration() * 1000), 1))
+        self.progressBar.setValue(0)
+        self.startPosition = 0.0
+        self.clearLoop()
+        if not self.firstPreviewShown:
+            self.firstPreviewShown = True
+            self.logStartupPhase("first preview loaded")
 
     def hideMidiFile(self):
         self.scrollArea.setVisible(False)
@@ -123,52 +202,198 @@ class MainWindow(QMainWindow):
 
             
     def playTrack(self):  
+        if self.chHandler is None:
+            self.updateLog("DSP-Board not connected yet", WARNING)
+            return
+        if self.player.is_playing:
+            return
         #load parameters
-        self.is_stopped = False
-        self.progressBar.setMaximum(self.midVis.getMessageCount())
+        # the progress bar runs in milliseconds of song time
+        self.progressBar.setMaximum(max(int(self.midVis.getDuration() * 1000), 1))
+        self.playingIndex = self.cbMidiFile.currentIndex()
+        self.prefetchNext()
+        # a stop from now on ends the whole playlist
+        self.player.start()
         #create worker thread
         worker = Worker(self.playMidiFile)
         worker.signals.finished.connect(self.stopTrack)
         worker.signals.progress.connect(self.progress_fn)
         # Execute worker
         self.threadpool.start(worker)
+        self.playheadTimer.start()
         self.updateLog("Start playing File")        
 
+    def setPlaylist(self, checked):
+        self.playlist = checked
+        self.updateLog("Playlist on" if checked else "Playlist off")
+        if self.isPlaying():
+            self.prefetchNext()
+
+    def prefetchNext(self):
+        # parse and compile the file after the playing one while it plays
+        self.prefetched = None
+        index = self.playingIndex + 1
+        if not self.playlist or index >= len(self.fileList):
+            return
+        worker = Worker(self.prefetchFile, self.fileList[index])
+        worker.signals.result.connect(self.prefetchReady)
+        self.threadpool.start(worker)
+
+    def prefetchFile(self, filename, progress_callback):
+        return filename, self.loadPlaylistFile(filename)
+
+    def loadPlaylistFile(self, filename):
+        # an own visualizer, the one of the GUI shows the playing file. The song cache is shared,
+        # switching the preview to the file later needs no parsing.
+        from visualizer import MidiVisualizer
+        visualizer = MidiVisualizer(self.midVis.songCache)
+        visualizer.loadSong(filename)
+        visualizer.getTimeline()
+        return visualizer
+
+    def prefetchReady(self, result):
+        # a late result of a file the playlist has passed meanwhile is dropped
+        index = self.playingIndex + 1
+        if index < len(self.fileList) and self.fileList[index] == result[0]:
+            self.prefetched = result
+
+    def showPlaylistTrack(self, index):
+        self.cbMidiFile.setCurrentIndex(index)
+        self.filename = self.fileList[index]
+        self.midVis.loadSong(self.filename)
+        self.showMidiFile()
+        self.updateLog("Playing " + self.filename)
+        self.prefetchNext()
+
     def stopTrack(self):
-        self.is_stopped = True
+        if self.chHandler is None:
+            return
+        self.player.stop()
+        self.playheadTimer.stop()
+        self.preview.setPlayhead(None)
         self.progressBar.setValue(0)
+        self.startPosition = 0.0
         self.updateLog("Stop playing File")
 
+    def updatePlayhead(self):
+        if not self.isPlaying():
+            return
+        x = self.showPlayhead(self.player.getPosition())
+        if x is None:
+            return
+        # keep the playhead in the left third of the visible part
+        scrollBar = self.scrollArea.horizontalScrollBar()
+        visibleWidth = self.scrollArea.viewport().width()
+        if x < scrollBar.value() or x > scrollBar.value() + visibleWidth * 2 / 3:
+            scrollBar.setValue(int(x - visibleWidth / 3))
+
+    def showPlayhead(self, seconds):
+        # the preview is laid out in ticks, returns the x position of the playhead
+        return self.preview.setPlayhead(float(self.midVis.getTempoMap().secondsToTicks(seconds)))
+
+    def eventFilter(self, obj, event):
+        if obj is self.progressBar and event.type() == QEvent.MouseButtonPress and self.midVis is not None:
+            self.seekTo(event.pos().x() / max(self.progressBar.width(), 1) * self.midVis.getDuration())
+            return True
+        return super(MainWindow, self).eventFilter(obj, event)
+
+    def isPlaying(self):
+        return self.chHandler is not None and self.player.is_playing
+
+    def getPosition(self):
+        # song time in seconds of the running track or where the next one starts
+        if self.isPlaying():
+            return self.player.getPosition()
+        return self.startPosition
+
+    def seekTo(self, position):
+        self.progressBar.setValue(int(position * 1000))
+        if self.isPlaying():
+            self.player.seek(position)
+        else:
+            self.startPosition = position
+            self.showPlayhead(position)
+        self.updateLog("Seek to {:.1f} s".format(position))
+
+    def setLoopPoint(self):
+        if self.chHandler is None:
+            return
+        position = self.getPosition()
+        if self.loopStart is None:
+            self.loopStart = position
+            self.buttonLoop.setText("B")
+            self.updateLog("Loop start at {:.1f} s".format(position))
+        elif self.player.loopStart is None and position > self.loopStart:
+            self.player.setLoop(self.loopStart, position)
+            self.buttonLoop.setText("A-B off")
+            self.updateLog("Looping {:.1f} s - {:.1f} s".format(self.loopStart, position))
+        else:
+            self.clearLoop()
+            self.updateLog("Loop off")
+
+    def clearLoop(self):
+        self.loopStart = None
+        self.buttonLoop.setText("A-B")
+        if self.chHandler is not None:
+            self.player.setLoop(None, None)
+
     def setVolume(self):
         #set global volume here
         newVolume = self.adjustVolume.value()
+        if self.chHandler is None:
+            return
         self.chHandler.setVolume(newVolume)
         self.updateLog("Set Volume to " + str(newVolume-48)) #offset to display value from zero upwards
 
-    def updateLog(self, message):
-        now = datetime.now()
-        self.logOutput.append(now.strftime("%H:%M:%S") + "  " + message + "\n")
+    def updateLog(self, message, level=INFO):
+        # safe from any thread, never touches the widget
+        self.logBuffer.add(message, level)
+
+    def drainLog(self):
+        records = [record for record in self.logBuffer.drain() if record[1] >= self.logLevel]
+        if not records:
+            return
+        lines = []
+        for timestamp, level, message in records:
+            prefix = "" if level == INFO else LEVEL_NAMES[level] + ": "
+            lines.append(datetime.fromtimestamp(timestamp).strftime("%H:%M:%S") + "  " + prefix + message + "\n")
+        # one append per batch instead of one per record
+        self.logOutput.append("\n".join(lines))
 
     def playMidiFile(self, progress_callback):
-        mid = MidiFile(self.filename)
-        msgCounter = 0
-        maxTones= 0 
-        
-        for msg in mid.play():
-            if not msg.is_meta:
-                if self.is_stopped:
-                    self.chHandler.dspInterface.resetDSP()
-                    return "Stopped"
-                if not msg.is_cc():
-                    if msg.type in ("note_on", "note_off"):
-                        if msg.type == "note_on":
-                            self.chHandler.startTone(msg.note, msg.velocity,  msg.dict()["channel"])
-                            progress_callback.emit(msgCounter)
-                            msgCounter += 1
-                        elif msg.type  == "note_off":
-                            self.chHandler.stopTone(msg.note, msg.dict()["channel"])
-                        maxTones = max(maxTones, len(self.chHandler.tones))
-        return "Done."
+        # the visualizer already parsed the file, play its precompiled timeline
+        timeline = self.midVis.getTimeline()
+        duration = self.midVis.getDuration()
+        result = self.player.play(timeline, progress_callback, self.startPosition)
+        self.updateLog(self.player.stats.getReport())
+        # in playlist mode the next file starts on the clock deadline the last one ended on
+        while result == "Done." and self.playlist and self.playingIndex + 1 < len(self.fileList):
+            index = self.playingIndex + 1
+            filename = self.fileList[index]
+            prefetched = self.prefetched
+            try:
+                if prefetched is not None and prefetched[0] == filename:
+                    visualizer = prefetched[1]
+                else:
+                    # not prefetched (yet), this leaves a gap
+                    visualizer = self.loadPlaylistFile(filename)
+                timeline = visualizer.getTimeline()
+            except (OSError, EOFError, ValueError):
+                self.updateLog("Error opening " + filename, ERROR)
+                break
+            # stopped while the file was loaded
+            if self.player.is_stopped:
+                result = "Stopped"
+                break
+            self.playingIndex = index
+            self.trackChanged.emit(index)
+            result = self.player.play(timeline, progress_callback, continueAt=duration)
+            duration = visualizer.getDuration()
+            self.updateLog(self.player.stats.getReport())
+        usbStats = self.chHandler.getWriterStats()
+        if usbStats["overflows"] or usbStats["errors"]:
+            self.updateLog("USB queue overflows: {}, write errors: {}".format(usbStats["overflows"], usbStats["errors"]), WARNING)
+        return result
 
     # thread signal outputs
     def progress_fn(self, counter):
@@ -0,0 +1,96 @@
+import mido
+from midi_stream import MidiStreamReader
+from song_cache import CompiledSong
+from timeline import TempoMap, compileTimeline
+
+
+class MidiSong(mido.MidiFile):
+    # the parsed events of a midi file, everything playback needs and nothing to draw it
+    def __init__(self, songCache=None):
+        self.meta = {}
+        self.totalTicks = 0
+        self.filename = None
+        self.events = None
+        self.timeline = None
+        self.tempoChanges = []
+        self.ticks_per_beat = 480
+        self.tempoMap = None
+        # optional SongCache, songs parsed before are taken from there
+        self.songCache = songCache
+        self.song = None
+
+    def open(self, filename):
+        # forget the previous file, the new one is parsed on demand
+        self.filename = filename
+        self.events = None
+        self.timeline = None
+        self.tempoMap = None
+        self.song = None
+
+    def getSong(self):
+        # the CompiledSong of the open file, with a cache it may already hold everything
+        if self.song is None:
+            if self.songCache is not None:
+                self.song = self.songCache.get(self.filename)
+            else:
+                self.song = CompiledSong(None, self.filename)
+        return self.song
+
+    def updateSong(self, save=False):
+        # account parts added to the song, optionally write it to the disk cache as well
+        if self.songCache is not None:
+            self.songCache.put(self.song)
+            if save:
+                self.songCache.save(self.song)
+
+    def getTimeline(self):
+        # compiled playback events of the file, parsed here if nobody did before
+        if self.timeline is None:
+            if self.events is None:
+                self.events, trackCount = self.get_events(self.filename)
+            song = self.getSong()
+            if song.timeline is None:
+                song.timeline = compileTimeline(self.events, self.getTempoMap())
+                self.updateSong(save=True)
+            self.timeline = song.timeline
+        return self.timeline
+
+    def get_events(self, file):
+        # one streaming pass over the file into a struct of arrays (see midi_stream.py),
+        # shared by the preview and the player and kept in the song cache
+        if file != self.filename:
+            self.open(file)
+        song = self.getSong()
+        if song.events is None:
+            song.events = MidiStreamReader(file).read()
+            self.updateSong()
+        events = song.events
+        self.ticks_per_beat = events.ticksPerBeat
+        self.totalTicks = events.totalTicks
+        # every (tick, tempo) of the file in file order
+        self.tempoChanges = events.tempoChanges
+        self.tempoMap = None
+        self.meta = {}
+        if self.tempoChanges:
+            self.meta["set_tempo"] = {"tempo": self.tempoChanges[-1][1]}
+        return events, events.trackCount
+
+    def getTempoMap(self):
+        # tick <-> second conversion of the open file, built from its tempo changes on first use
+        if self.tempoMap is None:
+            self.tempoMap = TempoMap(self.tempoChanges, self.ticks_per_beat)
+        return self.tempoMap
+
+    def getDuration(self):
+        # length of the song in seconds, every tempo change included
+        return float(self.getTempoMap().ticksToSeconds(self.totalTicks))
+
+    def get_tempo(self):
+        # the last tempo of the file, only for display, use getTempoMap() for any timing
+        try:
+            return self.meta["set_tempo"]["tempo"]
+        except:
+            return 500000
+
+    def get_total_ticks(self):
+        return self.totalTicks
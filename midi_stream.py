@@ -0,0 +1,158 @@
+from array import array
+import numpy as np
+
+# status nibbles of the channel messages
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+POLY_AFTERTOUCH = 0xA0
+CONTROL_CHANGE = 0xB0
+PROGRAM_CHANGE = 0xC0
+CHANNEL_AFTERTOUCH = 0xD0
+PITCH_BEND = 0xE0
+
+# meta events that are decoded
+META_END_OF_TRACK = 0x2F
+META_SET_TEMPO = 0x51
+
+# number of data bytes of every channel message
+DATA_LENGTHS = {NOTE_OFF: 2, NOTE_ON: 2, POLY_AFTERTOUCH: 2, CONTROL_CHANGE: 2,
+                PROGRAM_CHANGE: 1, CHANNEL_AFTERTOUCH: 1, PITCH_BEND: 2}
+# number of data bytes of the system common and realtime messages (song position, song select,
+# tune request, clock, ...), they are skipped and leave the running status alone
+SYSTEM_DATA_LENGTHS = {0xF1: 1, 0xF2: 2, 0xF3: 1}
+
+
+class MidiEvents:
+    # All channel messages of a midi file as a struct of arrays, sorted by tick (ties keep the
+    # file order). kind is the status nibble (NOTE_ON, CONTROL_CHANGE, ...).
+    def __init__(self, tick, status, data1, data2, track) -> None:
+        order = np.argsort(tick, kind='stable')
+        self.tick = tick[order]
+        status = status[order]
+        self.kind = status & 0xF0
+        self.channel = status & 0x0F
+        self.data1 = data1[order]
+        self.data2 = data2[order]
+        self.track = track[order]
+        # filled in by the reader
+        self.ticksPerBeat = 480
+        self.trackCount = 0
+        self.totalTicks = 0
+        self.tempoChanges = []
+        self.noteOnCount = 0
+
+    def __len__(self):
+        return len(self.tick)
+
+    def getBytes(self):
+        return sum(column.nbytes for column in (self.tick, self.kind, self.channel, self.data1, self.data2, self.track))
+
+
+class MidiStreamReader:
+    # Reads a standard midi file one track chunk at a time straight into typed arrays, no message
+    # objects are created. Totals (length, tempo changes, note count) are collected on the way.
+    def __init__(self, filename) -> None:
+        self.filename = filename
+
+    def read(self):
+        tick = array('q')
+        status = array('B')
+        data1 = array('B')
+        data2 = array('B')
+        track = array('H')
+        tempoChanges = []
+        totalTicks = 0
+        noteOnCount = 0
+
+        with open(self.filename, 'rb') as f:
+            ticksPerBeat = self.readHeader(f)
+            trackIndex = 0
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    break
+                length = int.from_bytes(chunk[4:8], 'big')
+                if chunk[:4] != b'MTrk':
+                    # unknown chunks are skipped
+                    f.seek(length, 1)
+                    continue
+                data = f.read(length)
+
+                # parse the events of this track, a truncated track ends where its data ends
+                position = 0
+                now = 0
+                runningStatus = 0
+                end = len(data)
+                try:
+                    while position < end:
+                        delta, position = self.readVarLength(data, position)
+                        now += delta
+                        byte = data[position]
+                        if byte == 0xFF:
+                            metaType = data[position + 1]
+                            size, position = self.readVarLength(data, position + 2)
+                            if metaType == META_SET_TEMPO and size == 3:
+                                tempoChanges.append((now, int.from_bytes(data[position:position + 3], 'big')))
+                            position += size
+                            if metaType == META_END_OF_TRACK:
+                                break
+                            continue
+                        if byte in (0xF0, 0xF7):
+                            size, position = self.readVarLength(data, position + 1)
+                            position += size
+                            continue
+                        if byte > 0xF0:
+                            position += 1 + SYSTEM_DATA_LENGTHS.get(byte, 0)
+                            continue
+                        if byte & 0x80:
+                            runningStatus = byte
+                            position += 1
+                        elif not runningStatus:
+                            raise ValueError("Data byte without status in " + self.filename)
+                        kind = runningStatus & 0xF0
+                        first = data[position] & 0x7F
+                        second = data[position + 1] & 0x7F if DATA_LENGTHS[kind] == 2 else 0
+                        position += DATA_LENGTHS[kind]
+                        tick.append(now)
+                        status.append(runningStatus)
+                        data1.append(first)
+                        data2.append(second)
+                        track.append(trackIndex)
+                        if kind == NOTE_ON and second > 0:
+                            noteOnCount += 1
+                except IndexError:
+                    # the last event of the track is cut off
+                    pass
+                totalTicks = max(totalTicks, now)
+                trackIndex += 1
+
+        events = MidiEvents(np.frombuffer(tick, dtype=np.int64), np.frombuffer(status, dtype=np.uint8),
+                            np.frombuffer(data1, dtype=np.uint8), np.frombuffer(data2, dtype=np.uint8),
+                            np.frombuffer(track, dtype=np.uint16))
+        events.ticksPerBeat = ticksPerBeat
+        events.trackCount = trackIndex
+        events.totalTicks = totalTicks
+        events.tempoChanges = tempoChanges
+        events.noteOnCount = noteOnCount
+        return events
+
+    def readHeader(self, f):
+        header = f.read(14)
+        if len(header) < 14:
+            raise EOFError("No midi header in " + self.filename)
+        if header[:4] != b'MThd':
+            raise ValueError(self.filename + " is not a midi file")
+        size = int.from_bytes(header[4:8], 'big')
+        ticksPerBeat = int.from_bytes(header[12:14], 'big')
+        # longer headers are allowed, skip the rest
+        f.seek(size - 6, 1)
+        return ticksPerBeat
+
+    def readVarLength(self, data, position):
+        value = 0
+        while True:
+            byte = data[position]
+            position += 1
+            value = (value << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                return value, position
@@ -1,6 +1,9 @@
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
+import sys
+import traceback
+from time import perf_counter
 
 class WorkerSignals(QObject):
     '''
@@ -18,15 +21,33 @@ class WorkerSignals(QObject):
         object data returned from processing, anything
 
     progress
-        int indicating % progress
+        int indicating progress, coalesced to at most 30 per second
 
     '''
-    finished = pyqtSignal(str)
+    finished = pyqtSignal(object)
     error = pyqtSignal(tuple)
     result = pyqtSignal(object)
     progress = pyqtSignal(int)
 
 
+class CoalescedSignal:
+    '''
+    Forwards emit() to a signal at most rate times a second, values in between are dropped.
+    Keeps busy threads from flooding the Qt event loop with queued signals.
+    '''
+
+    def __init__(self, signal, rate=30):
+        self.signal = signal
+        self.interval = 1 / rate
+        self.lastEmit = 0.0
+
+    def emit(self, value):
+        now = perf_counter()
+        if now - self.lastEmit >= self.interval:
+            self.lastEmit = now
+            self.signal.emit(value)
+
+
 class Worker(QRunnable):
     '''
     Worker thread
@@ -50,8 +71,8 @@ class Worker(QRunnable):
         self.kwargs = kwargs
         self.signals = WorkerSignals()
 
-        # Add the callback to our kwargs
-        self.kwargs['progress_callback'] = self.signals.progress
+        # Add the callback to our kwargs, progress reaches the GUI at most 30 times a second
+        self.kwargs['progress_callback'] = CoalescedSignal(self.signals.progress)
 
     @pyqtSlot()
     def run(self):
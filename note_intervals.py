@@ -0,0 +1,63 @@
+import numpy as np
+
+# one color per midi channel, the same hues the preview always used: hue i/16 at full saturation
+# and value, the red, green and blue ramps of matplotlib.colors.hsv_to_rgb
+CHANNEL_COLORS = np.clip(np.abs(np.arange(16)[:, None] * 6 / 16 - [3, 2, 4]) * [1, -1, -1] + [-1, 2, 2], 0, 1)
+
+
+class NoteIntervals:
+    # compact piano roll: one entry per sounding note, stored as parallel arrays
+    def __init__(self, channel, note, start, end, intensity):
+        self.channel = np.asarray(channel, dtype=np.uint8)
+        self.note = np.asarray(note, dtype=np.uint8)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.intensity = np.asarray(intensity, dtype=np.uint8)
+        self.channelMax = None
+
+    def __len__(self):
+        return len(self.note)
+
+    def getChannelMax(self):
+        # loudest note of every channel, computed once and shared by all tiles of the song.
+        # Tiles are rendered in parallel, the array is only published when it is complete.
+        if self.channelMax is None:
+            channelMax = np.zeros(16)
+            np.maximum.at(channelMax, self.channel, self.intensity)
+            self.channelMax = channelMax
+        return self.channelMax
+
+    def rasterize(self, endTick, width, startTick=0):
+        # bin the notes between startTick and endTick into a (128 x width) RGBA image,
+        # cost scales with covered pixels. Tiles of the preview pass their part of the song.
+        image = np.zeros((128, width, 4), dtype=np.float32)
+        if len(self) == 0 or endTick <= startTick or width <= 0:
+            return image
+
+        # shade each note by its intensity relative to the loudest note of its channel in the whole song
+        channelMax = self.getChannelMax()
+        visible = (self.end > startTick) & (self.start < endTick)
+        channel = self.channel[visible]
+        note = self.note[visible]
+        intensity = self.intensity[visible]
+        level = np.rint(intensity * 255.0 / channelMax[channel]).astype(np.int64)
+
+        # pixel columns covered by every note, at least one column so short notes stay visible
+        scale = width / (endTick - startTick)
+        first = np.clip(np.floor((self.start[visible] - startTick) * scale).astype(np.int64), 0, width - 1)
+        last = np.clip(np.ceil((self.end[visible] - startTick) * scale).astype(np.int64), first + 1, width)
+        lengths = last - first
+
+        # composite all channels in one pass: higher channels lie on top, louder notes win inside a channel
+        key = channel.astype(np.int64) * 256 + level
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        pixels = np.repeat(note.astype(np.int64) * width + first, lengths) + offsets
+        keys = np.zeros(128 * width, dtype=np.int64)
+        np.maximum.at(keys, pixels, np.repeat(key, lengths))
+
+        covered = keys > 0
+        alpha = (keys[covered] % 256) / 255
+        flat = image.reshape(-1, 4)
+        flat[covered, :3] = alpha[:, None] * CHANNEL_COLORS[keys[covered] // 256]
+        flat[covered, 3] = alpha
+        return image
@@ -0,0 +1,245 @@
+import threading
+from time import perf_counter, perf_counter_ns, sleep
+import numpy as np
+from tracer import DISPATCH
+from timeline import NOTE_ON, NOTE_OFF, getBend, getChannelBends, getSoundingNotes
+
+
+class PlaybackClock:
+    # Absolute deadlines on a monotonic clock: sleep coarse, spin the last fraction of a millisecond.
+    # Errors never add up because every wait targets start time + event time, not the previous event.
+    def __init__(self, spinTime=0.0008) -> None:
+        self.spinTime = spinTime
+        self.startTime = perf_counter()
+
+    def start(self, position=0.0):
+        # position in seconds that corresponds to now
+        self.startTime = perf_counter() - position
+
+    def now(self):
+        return perf_counter() - self.startTime
+
+    def advance(self, seconds):
+        # song time seconds becomes the new 0, deadlines of the next track follow without a gap
+        self.startTime += seconds
+
+    def waitUntil(self, deadline, interrupt=None):
+        # returns how late (in seconds) the deadline was reached, when behind it returns at once.
+        # A set interrupt event ends the wait early and None is returned instead.
+        target = self.startTime + deadline
+        remaining = target - perf_counter()
+        if interrupt is not None:
+            if interrupt.wait(max(remaining - self.spinTime, 0)):
+                return None
+        elif remaining > self.spinTime:
+            sleep(remaining - self.spinTime)
+        while True:
+            now = perf_counter()
+            if now >= target:
+                return now - target
+
+
+class VirtualClock:
+    # PlaybackClock that never waits: every deadline is reached at once and becomes the current
+    # time. Runs the player as fast as possible (offline rendering, benchmarks).
+    def __init__(self) -> None:
+        self.time = 0.0
+
+    def start(self, position=0.0):
+        self.time = position
+
+    def now(self):
+        return self.time
+
+    def advance(self, seconds):
+        self.time -= seconds
+
+    def waitUntil(self, deadline, interrupt=None):
+        if interrupt is not None and interrupt.is_set():
+            return None
+        self.time = max(self.time, deadline)
+        return 0.0
+
+
+class LatenessStats:
+    # per event lateness of a track, stored in an array preallocated for one pass
+    BINS_MS = [0.1, 0.5, 1, 2, 5, 10, 50]
+
+    def __init__(self, capacity=0) -> None:
+        self.reset(capacity)
+
+    def reset(self, capacity):
+        self.values = np.zeros(capacity)
+        self.count = 0
+
+    def add(self, lateness):
+        # loops and seeks play events more than once, then the array grows
+        if self.count == len(self.values):
+            self.values = np.concatenate((self.values, np.zeros(max(len(self.values), 1024))))
+        self.values[self.count] = lateness
+        self.count += 1
+
+    def getSummary(self):
+        values = self.values[:self.count] * 1000
+        if not len(values):
+            return None
+        counts = np.bincount(np.searchsorted(self.BINS_MS, values), minlength=len(self.BINS_MS) + 1)
+        return {
+            "events": len(values),
+            "p50": float(np.percentile(values, 50)),
+            "p99": float(np.percentile(values, 99)),
+            "max": float(values.max()),
+            "histogram": counts.tolist(),
+        }
+
+    def getReport(self):
+        summary = self.getSummary()
+        if summary is None:
+            return "Timing: no events played"
+        labels = ["<" + str(limit) for limit in self.BINS_MS] + [">" + str(self.BINS_MS[-1])]
+        histogram = ", ".join(label + "ms: " + str(count) for label, count in zip(labels, summary["histogram"]))
+        return "Timing of {} events: lateness p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms ({})".format(
+            summary["events"], summary["p50"], summary["p99"], summary["max"], histogram)
+
+
+class TimelinePlayer:
+    # plays a compiled timeline (see timeline.compileTimeline) on a ChannelHandler. stop(), seek()
+    # and setLoop() may be called from any thread, they wake the player up while it waits.
+    # clock: a PlaybackClock by default, a VirtualClock dispatches without waiting
+    def __init__(self, chHandler, clock=None) -> None:
+        self.chHandler = chHandler
+        self.is_stopped = False
+        self.clock = clock if clock is not None else PlaybackClock()
+        self.stats = LatenessStats()
+        self.wakeUp = threading.Event()
+        self.pendingSeek = None
+        self.loopStart = None
+        self.loopEnd = None
+        self.is_playing = False
+        # optional tracer.Tracer, every dispatched event is recorded as a span
+        self.tracer = None
+
+    def start(self):
+        # call once before the first play() of a track or playlist, a stop() after it ends all
+        # following play() calls, also one issued between two tracks
+        self.is_stopped = False
+
+    def stop(self):
+        self.is_stopped = True
+        self.wakeUp.set()
+
+    def seek(self, position):
+        # continue at position (seconds) with the notes sounding there
+        self.pendingSeek = max(position, 0.0)
+        self.wakeUp.set()
+
+    def setLoop(self, start, end):
+        # repeat start..end (seconds) until stopped, setLoop(None, None) plays on to the end
+        if start is not None and end is not None and end <= start:
+            raise ValueError("The end of a loop has to be after its start")
+        self.loopStart = start
+        self.loopEnd = end
+        self.wakeUp.set()
+
+    def getPosition(self):
+        # current song time in seconds, only meaningful while playing
+        return self.clock.now()
+
+    def jump(self, timeline, position):
+        # silence everything, then start the notes that are held at position with the bends there
+        self.chHandler.resetDSP()
+        index = int(np.searchsorted(timeline["time"], position, side='left'))
+        for row in getChannelBends(timeline, index).tolist():
+            time, op, low, high, channel = row
+            self.chHandler.pitchBend(getBend(low, high), channel)
+        for row in getSoundingNotes(timeline, index).tolist():
+            time, op, note, velocity, channel = row
+            self.chHandler.startTone(note, velocity, channel)
+        self.chHandler.flush()
+        self.clock.start(position)
+        return index
+
+    def play(self, timeline, progress_callback=None, position=0.0, continueAt=None):
+        # continueAt: the end of the track played before in its song time, this one starts on that
+        # deadline of the same clock without a reset
+        if self.is_stopped:
+            return "Stopped"
+        self.pendingSeek = None
+        self.wakeUp.clear()
+        # plain python lists, the loop below works on ints and floats only
+        times = timeline["time"].tolist()
+        ops = timeline["op"].tolist()
+        notes = timeline["note"].tolist()
+        velocities = timeline["velocity"].tolist()
+        channels = timeline["channel"].tolist()
+        # flush the USB frame after the last event of every timestamp
+        flushAfter = np.append(np.diff(timeline["time"]) > 0, True).tolist()
+        startTone = self.chHandler.startTone
+        stopTone = self.chHandler.stopTone
+        pitchBend = self.chHandler.pitchBend
+        flush = self.chHandler.flush
+        waitUntil = self.clock.waitUntil
+        wakeUp = self.wakeUp
+        addLateness = self.stats.add
+        self.stats.reset(len(times))
+        tracer = self.tracer
+
+        self.is_playing = True
+        if continueAt is not None:
+            index = 0
+            # the previous track released its voices when it was done
+            self.clock.advance(continueAt)
+        elif position > 0:
+            index = self.jump(timeline, position)
+        else:
+            index = 0
+            self.clock.start()
+        loopEnd = self.loopEnd if self.loopStart is not None else None
+        eventCount = len(times)
+        try:
+            while True:
+                # the next deadline is the next event or the end of the loop, whatever comes first
+                atLoopEnd = loopEnd is not None and (index >= eventCount or times[index] >= loopEnd)
+                if atLoopEnd:
+                    deadline = loopEnd
+                elif index < eventCount:
+                    deadline = times[index]
+                else:
+                    # notes the file never released must not keep sounding
+                    self.chHandler.releaseAll()
+                    return "Done."
+                # late events are sent right away, the following ones stay on their absolute deadlines
+                lateness = waitUntil(deadline, wakeUp)
+                if lateness is None or self.is_stopped:
+                    # woken up by stop, seek or a new loop
+                    wakeUp.clear()
+                    if self.is_stopped:
+                        self.chHandler.resetDSP()
+                        return "Stopped"
+                    if self.pendingSeek is not None:
+                        index = self.jump(timeline, self.pendingSeek)
+                        self.pendingSeek = None
+                    loopEnd = self.loopEnd if self.loopStart is not None else None
+                    continue
+                if atLoopEnd:
+                    index = self.jump(timeline, self.loopStart)
+                    continue
+                addLateness(lateness)
+                if tracer is not None:
+                    dispatchStart = perf_counter_ns()
+                if ops[index] == NOTE_ON:
+                    startTone(notes[index], velocities[index], channels[index])
+                    if progress_callback is not None:
+                        # position in milliseconds of song time, the Worker coalesces these
+                        progress_callback.emit(int(times[index] * 1000))
+                elif ops[index] == NOTE_OFF:
+                    stopTone(notes[index], channels[index])
+                else:
+                    pitchBend(getBend(notes[index], velocities[index]), channels[index])
+                if flushAfter[index]:
+                    flush()
+                if tracer is not None:
+                    tracer.record(DISPATCH, dispatchStart)
+                index += 1
+        finally:
+            self.is_playing = False
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+
+
+class PreviewCache:
+    # Previews are stored as <hash>.png next to a <hash>.json sidecar, the hash covers the
+    # midi bytes and the renderer version, so edited files or a new renderer never hit stale images.
+    def __init__(self, directory, version) -> None:
+        self.directory = directory
+        self.version = version
+
+    def getKey(self, filename):
+        digest = hashlib.sha1(str(self.version).encode())
+        with open(filename, 'rb') as f:
+            digest.update(f.read())
+        return digest.hexdigest()
+
+    def getImagePath(self, key):
+        return os.path.join(self.directory, key + ".png")
+
+    def getInfoPath(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def load(self, key):
+        # returns the sidecar of a complete cache entry or None
+        if not os.path.exists(self.getImagePath(key)):
+            return None
+        try:
+            with open(self.getInfoPath(key)) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if info.get("version") != self.version:
+            return None
+        return info
+
+    def store(self, key, info):
+        # the image has to be written before, the sidecar marks the entry as complete
+        info = dict(info, version=self.version)
+        infoPath = self.getInfoPath(key)
+        with open(infoPath + ".tmp", 'w') as f:
+            json.dump(info, f)
+        os.replace(infoPath + ".tmp", infoPath)
+        # drop older previews of the same file
+        for oldKey, oldInfo in self.entries():
+            if oldKey != key and oldInfo.get("source") == info.get("source"):
+                self.remove(oldKey)
+
+    def remove(self, key):
+        for path in (self.getInfoPath(key), self.getImagePath(key)):
+            # another process may be removing the same entry
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def entries(self):
+        # all sidecars in the cache as (key, info)
+        entries = []
+        for file in sorted(os.listdir(self.directory)):
+            key, ext = os.path.splitext(file)
+            if ext != ".json":
+                continue
+            info = self.load(key)
+            if info is not None:
+                entries.append((key, info))
+        return entries
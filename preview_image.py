@@ -0,0 +1,73 @@
+import matplotlib.pyplot as plt
+from visualizer import MidiVisualizer
+
+
+class PreviewImageRenderer(MidiVisualizer):
+    # renders the preview of a song to a PNG in the preview cache, for the headless previews
+    # and the benchmark. Only this module needs matplotlib.
+    def __init__(self, songCache=None):
+        MidiVisualizer.__init__(self, songCache)
+        self.fig = None
+
+    def renderPreview(self, filename):
+        # makes sure the preview image of the file is in the cache, parses the file only if it is not
+        self.open(filename)
+        key = self.previewCache.getKey(filename)
+        self.visualizationFile = self.previewCache.getImagePath(key)
+        info = self.previewCache.load(key)
+        if info is None:
+            # not rendered yet, parse and rasterize the file
+            self.events, trackCount = self.get_events(filename)
+            info = self.draw_midiImage()
+            info["trackCount"] = trackCount
+            self.previewCache.store(key, info)
+            # the layout is the same the tiled preview uses
+            self.getSong().info = info
+            self.updateSong(save=True)
+        # everything needed is in the sidecar
+        self.applyPreviewInfo(info)
+        return info["trackCount"]
+
+    def initFigure(self):
+        px = 1/plt.rcParams['figure.dpi']  # pixel to inches
+        self.xLength = 620*px # size of the diagram in x
+        self.fig = plt.figure(figsize=(self.xLength, 320*px), tight_layout=True) 
+        self.fig.tight_layout()
+        self.fig.patch.set_facecolor('none')
+        return self.fig
+
+    def applyPreviewInfo(self, info):
+        MidiVisualizer.applyPreviewInfo(self, info)
+        self.xLength = info["widthPixels"] / plt.rcParams['figure.dpi']
+        if self.fig is not None:
+            self.fig.set_size_inches(self.xLength, 320 / plt.rcParams['figure.dpi'], forward=True)
+
+    def draw_midiImage(self):
+        # renders the preview to self.visualizationFile and returns the information for its sidecar
+        midiInformation = self.getMidiInformation() #get data from midi file
+        info = self.getPreviewInfo(midiInformation)
+        plt.clf()
+        plt.subplots_adjust(left=0.045, right=1, top=1, bottom=0.09) #shift plot to corner
+        # add a new subplot
+        a1 = self.fig.add_subplot(111)      
+        # remove backgroud for current plot
+        a1.set_facecolor('none')            
+        px = 1/plt.rcParams['figure.dpi']  # pixel to inches 
+        self.xLength = info["widthPixels"]*px
+        # set the new figure size
+        self.fig.set_size_inches(self.xLength, 320*px, forward=True)
+        plt.xticks(info["tickPositions"], info["tickLabels"])
+        # add the scaled y-axes desciption to the plot
+        ax = plt.gca()
+        ax.set_ylim([info["minTone"], info["maxTone"]])
+
+        # render the notes at the pixel width of the figure and show them with a single image
+        image = midiInformation.rasterize(self.get_total_ticks(), info["widthPixels"])
+        a1.imshow(image, origin="lower", interpolation='nearest', aspect='auto',
+                  extent=(0, max(self.get_total_ticks(), 1), -0.5, 127.5))
+        a1.set_ylim([info["minTone"], info["maxTone"]])
+        # show midiInformation and save figure 
+        # !!! don't write any code between the next two lines !!!
+        plt.draw()
+        plt.savefig(self.visualizationFile,bbox_inches='tight')
+        return info
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import *
+import numpy as np
+from multithread import Worker
+
+# the preview is rendered in tiles of this many pixel columns, only the visible ones (and their
+# neighbours) are rendered and at most TILE_CACHE_SIZE of them are kept, whatever the song length
+TILE_WIDTH = 512
+TILE_CACHE_SIZE = 64
+TILE_THREADS = 2
+# room for the note and time descriptions around the notes
+LEFT_MARGIN = 30
+BOTTOM_MARGIN = 20
+PREVIEW_HEIGHT = 300
+
+
+class PreviewWidget(QWidget):
+    # Piano roll of the whole song in a QScrollArea. The widget is as wide as the song, but
+    # paintEvent only draws the tiles in the exposed rectangle. Missing tiles are rasterized
+    # by a thread pool from the note intervals and shown as soon as they are ready.
+    def __init__(self, parent=None):
+        super(PreviewWidget, self).__init__(parent)
+        self.threadpool = QThreadPool(self)
+        self.threadpool.setMaxThreadCount(TILE_THREADS)
+        self.tiles = OrderedDict()
+        # index -> generation of the tiles waiting for the thread pool
+        self.pending = {}
+        # bumped for every new song, tiles of the previous one are dropped when they arrive
+        self.generation = 0
+        self.intervals = None
+        self.info = None
+        self.tickScale = 1.0
+        self.playheadX = None
+        self.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.resize(LEFT_MARGIN + 620, PREVIEW_HEIGHT)
+
+    def setSong(self, intervals, info):
+        # info is the preview sidecar of MidiVisualizer.getPreviewInfo
+        self.clear()
+        self.intervals = intervals
+        self.info = info
+        self.tickScale = info["widthPixels"] / max(info["totalTicks"], 1)
+        self.resize(LEFT_MARGIN + info["widthPixels"], PREVIEW_HEIGHT)
+        self.update()
+
+    def clear(self):
+        self.generation += 1
+        self.pending.clear()
+        self.tiles.clear()
+        self.intervals = None
+        self.info = None
+        self.playheadX = None
+        self.update()
+
+    def getPlotRect(self):
+        return QRect(LEFT_MARGIN, 0, self.width() - LEFT_MARGIN, PREVIEW_HEIGHT - BOTTOM_MARGIN)
+
+    def getTileCount(self):
+        return (self.info["widthPixels"] + TILE_WIDTH - 1) // TILE_WIDTH
+
+    def getTileRange(self, rect):
+        # indices of the tiles a rectangle of the widget touches
+        first = max((rect.left() - LEFT_MARGIN) // TILE_WIDTH, 0)
+        last = min((rect.right() - LEFT_MARGIN) // TILE_WIDTH, self.getTileCount() - 1)
+        return range(first, max(last + 1, first))
+
+    def tickToX(self, tick):
+        return LEFT_MARGIN + tick * self.tickScale
+
+    def setPlayhead(self, tick):
+        # moves the playhead to a song position in ticks, None hides it.
+        # Returns its x position in widget pixels (or None) to scroll it into view.
+        old = self.playheadX
+        if tick is None or self.info is None:
+            self.playheadX = None
+        else:
+            self.playheadX = int(round(self.tickToX(min(max(tick, 0), self.info["totalTicks"]))))
+        if old == self.playheadX:
+            return self.playheadX
+        # only the strips of the old and the new line are painted again
+        for x in (old, self.playheadX):
+            if x is not None:
+                self.update(x - 1, 0, 3, PREVIEW_HEIGHT - BOTTOM_MARGIN)
+        return self.playheadX
+
+    def renderTile(self, generation, index, intervals, info, progress_callback):
+        # runs in the thread pool, returns the rows minTone..maxTone with the highest note on top.
+        # Requests that were dropped meanwhile return right away.
+        if self.pending.get(index) != generation:
+            return generation, index, None
+        width = min(TILE_WIDTH, info["widthPixels"] - index * TILE_WIDTH)
+        ticksPerPixel = max(info["totalTicks"], 1) / info["widthPixels"]
+        startTick = index * TILE_WIDTH * ticksPerPixel
+        image = intervals.rasterize(startTick + width * ticksPerPixel, width, startTick)
+        rows = image[info["minTone"]:min(info["maxTone"], 127) + 1][::-1]
+        # the colors are already multiplied by alpha
+        return generation, index, np.ascontiguousarray((rows * 255).round().astype(np.uint8))
+
+    def tileReady(self, result):
+        generation, index, pixels = result
+        if pixels is None or self.pending.get(index) != generation:
+            return
+        del self.pending[index]
+        height, width = pixels.shape[:2]
+        # copy() detaches the image from the NumPy buffer
+        self.tiles[index] = QImage(pixels.data, width, height, width * 4, QImage.Format_RGBA8888_Premultiplied).copy()
+        while len(self.tiles) > TILE_CACHE_SIZE:
+            self.tiles.popitem(last=False)
+        self.update(LEFT_MARGIN + index * TILE_WIDTH, 0, width, PREVIEW_HEIGHT - BOTTOM_MARGIN)
+
+    def requestTiles(self, indices):
+        # renders the missing tiles, requests of tiles that are no longer wanted are dropped first
+        for index in list(self.pending):
+            if index not in indices:
+                del self.pending[index]
+        for index in indices:
+            if index in self.tiles or index in self.pending:
+                continue
+            self.pending[index] = self.generation
+            worker = Worker(self.renderTile, self.generation, index, self.intervals, self.info)
+            worker.signals.result.connect(self.tileReady)
+            self.threadpool.start(worker)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        if self.info is None:
+            return
+        info = self.info
+        plot = self.getPlotRect()
+        exposed = event.rect()
+        for index in self.getTileRange(exposed):
+            tile = self.tiles.get(index)
+            if tile is not None:
+                self.tiles.move_to_end(index)
+                painter.drawImage(QRect(LEFT_MARGIN + index * TILE_WIDTH, plot.top(), tile.width(), plot.height()), tile)
+        # the tiles wanted are those in view, not only the exposed part (playhead strips, single
+        # tiles), and the neighbours, scrolling on shows them without waiting
+        visible = self.getTileRange(self.visibleRegion().boundingRect())
+        self.requestTiles(range(max(visible.start - 1, 0), min(visible.stop + 1, self.getTileCount())))
+
+        painter.setPen(self.palette().color(QPalette.WindowText))
+        # note axis, one description per 8 notes like the rendered preview
+        if exposed.left() < LEFT_MARGIN:
+            painter.drawLine(LEFT_MARGIN - 1, plot.top(), LEFT_MARGIN - 1, plot.bottom())
+            noteHeight = plot.height() / max(min(info["maxTone"], 127) + 1 - info["minTone"], 1)
+            for note in range(info["minTone"], info["maxTone"] + 1, 8):
+                y = int(plot.bottom() - (note - info["minTone"] + 0.5) * noteHeight)
+                painter.drawLine(LEFT_MARGIN - 4, y, LEFT_MARGIN - 1, y)
+                painter.drawText(QRect(0, y - 8, LEFT_MARGIN - 6, 16), Qt.AlignRight | Qt.AlignVCenter, str(note))
+        # time axis, only the descriptions in the exposed part
+        painter.drawLine(max(exposed.left(), LEFT_MARGIN), plot.bottom() + 1, exposed.right(), plot.bottom() + 1)
+        for tick, label in zip(info["tickPositions"], info["tickLabels"]):
+            x = int(self.tickToX(tick))
+            if exposed.left() - 40 <= x <= exposed.right() + 40:
+                painter.drawLine(x, plot.bottom() + 1, x, plot.bottom() + 4)
+                painter.drawText(QRect(x - 40, plot.bottom() + 4, 80, BOTTOM_MARGIN - 4), Qt.AlignHCenter | Qt.AlignTop, str(label))
+
+        if self.playheadX is not None:
+            painter.setPen(QPen(Qt.red, 1))
+            painter.drawLine(self.playheadX, plot.top(), self.playheadX, plot.bottom())
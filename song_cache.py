@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+import numpy as np
+from midi_stream import MidiEvents
+from note_intervals import NoteIntervals
+from timeline import EVENT_DTYPE
+
+# bump whenever the layout of the .npz files changes, old files are parsed again then
+SONG_FORMAT_VERSION = 3
+
+
+class CompiledSong:
+    # Everything derived from one midi file. The parts are filled in as they are needed:
+    # events by MidiSong.get_events, timeline by getTimeline, intervals/info by the visualizer.
+    def __init__(self, key, filename) -> None:
+        self.key = key
+        self.filename = filename
+        self.events = None
+        self.timeline = None
+        self.intervals = None
+        self.info = None
+
+    def getBytes(self):
+        size = 0
+        if self.events is not None:
+            size += self.events.getBytes()
+        if self.timeline is not None:
+            size += self.timeline.nbytes
+        if self.intervals is not None:
+            size += sum(column.nbytes for column in (self.intervals.channel, self.intervals.note, self.intervals.start,
+                                                     self.intervals.end, self.intervals.intensity))
+        return size
+
+
+class SongCache:
+    # LRU cache of CompiledSongs keyed by the hash of the midi bytes, bounded by maxBytes.
+    # With a directory, songs are also written as <hash>.npz and read back after a restart.
+    # The GUI and the playlist prefetch use it from different threads, a lock guards it.
+    def __init__(self, maxBytes=64 * 1024 * 1024, directory=None) -> None:
+        self.lock = threading.RLock()
+        self.maxBytes = maxBytes
+        self.directory = directory
+        self.songs = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+    def getKey(self, filename):
+        with open(filename, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, filename):
+        # returns the cached song of the file or a new empty one that is already in the cache
+        key = self.getKey(filename)
+        with self.lock:
+            song = self.songs.get(key)
+            if song is not None:
+                self.hits += 1
+                self.songs.move_to_end(key)
+                song.filename = filename
+                return song
+            song = self.load(key, filename)
+            if song is not None:
+                self.diskHits += 1
+            else:
+                self.misses += 1
+                song = CompiledSong(key, filename)
+            self.put(song)
+            return song
+
+    def put(self, song):
+        # (re)account the song after parts of it were filled in, evicts the least recently used songs
+        with self.lock:
+            old = self.songs.pop(song.key, None)
+            if old is not None:
+                self.size -= old.cachedBytes
+            song.cachedBytes = song.getBytes()
+            self.songs[song.key] = song
+            self.size += song.cachedBytes
+            # the newest song stays even if it alone is over the budget
+            while self.size > self.maxBytes and len(self.songs) > 1:
+                key, evicted = self.songs.popitem(last=False)
+                self.size -= evicted.cachedBytes
+
+    def clear(self):
+        with self.lock:
+            self.songs.clear()
+            self.size = 0
+
+    def save(self, song):
+        # writes the events of the song to disk together with whatever else was derived already
+        if self.directory is None or song.events is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        events = song.events
+        arrays = {
+            "tick": events.tick,
+            "status": events.kind | events.channel,
+            "data1": events.data1,
+            "data2": events.data2,
+            "track": events.track,
+            "tempoChanges": np.array(events.tempoChanges, dtype=np.int64).reshape(-1, 2),
+        }
+        if song.timeline is not None:
+            arrays["timeline"] = song.timeline
+        if song.intervals is not None:
+            for name in ("channel", "note", "start", "end", "intensity"):
+                arrays["interval_" + name] = getattr(song.intervals, name)
+        header = {
+            "version": SONG_FORMAT_VERSION,
+            "ticksPerBeat": events.ticksPerBeat,
+            "trackCount": events.trackCount,
+            "totalTicks": events.totalTicks,
+            "noteOnCount": events.noteOnCount,
+            "info": song.info,
+        }
+        arrays["header"] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+        # np.savez appends .npz to names without it, so the temporary file keeps the extension
+        path = self.getPath(song.key)
+        # two threads may save the same song, they must not share the temporary file
+        with self.lock:
+            with open(path + ".tmp", 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(path + ".tmp", path)
+
+    def load(self, key, filename):
+        if self.directory is None:
+            return None
+        try:
+            with np.load(self.getPath(key)) as data:
+                header = json.loads(data["header"].tobytes())
+                if header.get("version") != SONG_FORMAT_VERSION:
+                    return None
+                song = CompiledSong(key, filename)
+                # the arrays are already sorted, sorting again keeps them as they are
+                events = MidiEvents(data["tick"], data["status"], data["data1"], data["data2"], data["track"])
+                events.ticksPerBeat = header["ticksPerBeat"]
+                events.trackCount = header["trackCount"]
+                events.totalTicks = header["totalTicks"]
+                events.tempoChanges = [tuple(change) for change in data["tempoChanges"].tolist()]
+                events.noteOnCount = header["noteOnCount"]
+                song.events = events
+                if "timeline" in data:
+                    song.timeline = data["timeline"]
+                    if song.timeline.dtype != EVENT_DTYPE:
+                        return None
+                if "interval_note" in data:
+                    song.intervals = NoteIntervals(*(data["interval_" + name] for name in
+                                                     ("channel", "note", "start", "end", "intensity")))
+                song.info = header["info"]
+        except zipfile.BadZipFile:
+            # cut off or damaged (e.g. killed while saving), parsed and saved again
+            self.remove(key)
+            return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return song
+
+    def remove(self, key):
+        try:
+            os.remove(self.getPath(key))
+        except FileNotFoundError:
+            pass
+
+    def entries(self):
+        # (key, info) of the songs on disk that have a preview layout, only the headers are read
+        entries = []
+        if self.directory is None or not os.path.isdir(self.directory):
+            return entries
+        for file in sorted(os.listdir(self.directory)):
+            key, ext = os.path.splitext(file)
+            if ext != ".npz":
+                continue
+            try:
+                with np.load(os.path.join(self.directory, file)) as data:
+                    header = json.loads(data["header"].tobytes())
+            except zipfile.BadZipFile:
+                self.remove(key)
+                continue
+            except (OSError, ValueError, KeyError):
+                continue
+            if header.get("version") == SONG_FORMAT_VERSION and header.get("info") is not None:
+                entries.append((key, header["info"]))
+        return entries
+
+    def getStats(self):
+        return {"songs": len(self.songs), "bytes": self.size, "hits": self.hits,
+                "diskHits": self.diskHits, "misses": self.misses}
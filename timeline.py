@@ -0,0 +1,114 @@
+import numpy as np
+import midi_stream
+
+# opcodes of the compiled timeline
+NOTE_OFF = 0
+NOTE_ON = 1
+# note and velocity hold the low and high 7 bits of the 14 bit bend value, like the midi message
+PITCH_BEND = 2
+# order on the same timestamp: releases of earlier notes, then bends, then everything else in file order
+RELEASE_FIRST = 0
+BEND_FIRST = 1
+FILE_ORDER = 2
+
+# one row per playable event, sorted by time
+EVENT_DTYPE = np.dtype([
+    ("time", np.float64),   # absolute time in seconds
+    ("op", np.uint8),
+    ("note", np.uint8),
+    ("velocity", np.uint8),
+    ("channel", np.uint8),
+])
+
+DEFAULT_TEMPO = 500000
+
+
+class TempoMap:
+    # Breakpoints of all (tick, tempo) changes with the seconds elapsed at each of them, converts
+    # whole arrays between ticks and seconds with one searchsorted
+    def __init__(self, tempoChanges, ticksPerBeat) -> None:
+        # stable sort, of several changes on the same tick the last one wins
+        changes = sorted(tempoChanges, key=lambda change: change[0])
+        if not changes or changes[0][0] > 0:
+            changes.insert(0, (0, DEFAULT_TEMPO))
+        self.ticksPerBeat = ticksPerBeat
+        self.changeTicks = np.array([tick for tick, tempo in changes], dtype=np.int64)
+        self.tempos = np.array([tempo for tick, tempo in changes], dtype=np.float64)
+        self.secondsPerTick = self.tempos / (1e6 * ticksPerBeat)
+        self.changeSeconds = np.concatenate(([0.0], np.cumsum(np.diff(self.changeTicks) * self.secondsPerTick[:-1])))
+
+    def ticksToSeconds(self, ticks):
+        ticks = np.asarray(ticks, dtype=np.int64)
+        segment = np.maximum(np.searchsorted(self.changeTicks, ticks, side='right') - 1, 0)
+        return self.changeSeconds[segment] + (ticks - self.changeTicks[segment]) * self.secondsPerTick[segment]
+
+    def secondsToTicks(self, seconds):
+        # fractional ticks, round where whole ticks are needed
+        seconds = np.asarray(seconds, dtype=np.float64)
+        segment = np.maximum(np.searchsorted(self.changeSeconds, seconds, side='right') - 1, 0)
+        return self.changeTicks[segment] + (seconds - self.changeSeconds[segment]) / self.secondsPerTick[segment]
+
+    def getTempoAt(self, tick):
+        return int(self.tempos[max(np.searchsorted(self.changeTicks, tick, side='right') - 1, 0)])
+
+
+def compileTimeline(events, tempoMap):
+    # select the notes and pitch bends of the MidiEvents read by midi_stream and turn them into
+    # an EVENT_DTYPE array
+    kinds = events.kind
+    isPlayed = (kinds == midi_stream.NOTE_ON) | (kinds == midi_stream.NOTE_OFF) | (kinds == midi_stream.PITCH_BEND)
+    kinds = kinds[isPlayed]
+    velocities = events.data2[isPlayed]
+    timeline = np.empty(len(kinds), dtype=EVENT_DTYPE)
+    timeline["time"] = tempoMap.ticksToSeconds(events.tick[isPlayed])
+    # note_on with velocity 0 is a note_off
+    timeline["op"] = np.where(kinds == midi_stream.PITCH_BEND, PITCH_BEND,
+                              np.where((kinds == midi_stream.NOTE_ON) & (velocities > 0), NOTE_ON, NOTE_OFF))
+    timeline["note"] = events.data1[isPlayed]
+    timeline["velocity"] = velocities
+    timeline["channel"] = events.channel[isPlayed]
+    # the events are in file order on every tick, sort stably by time and on the same timestamp
+    # release notes started earlier first, so repeated notes are released before they start again,
+    # and bends before note_ons so new notes start at the bent pitch. A note_off of a note that
+    # starts on the same timestamp (zero length note) stays behind its note_on.
+    ops = timeline["op"]
+    order = np.full(len(timeline), FILE_ORDER, dtype=np.int64)
+    order[ops == PITCH_BEND] = BEND_FIRST
+    isNote = np.flatnonzero(ops != PITCH_BEND)
+    keys = timeline["channel"][isNote].astype(np.int64) * 128 + timeline["note"][isNote]
+    # every channel/note in file order, the last note_on before each row of the same note
+    byKey = isNote[np.argsort(keys, kind='stable')]
+    sortedKeys = timeline["channel"][byKey].astype(np.int64) * 128 + timeline["note"][byKey]
+    positions = np.arange(len(byKey))
+    lastOn = np.maximum.accumulate(np.where(ops[byKey] == NOTE_ON, positions, -1)) if len(byKey) else positions
+    groupStart = np.searchsorted(sortedKeys, sortedKeys)
+    onBefore = lastOn >= groupStart
+    startsTogether = onBefore & (timeline["time"][byKey[np.maximum(lastOn, 0)]] == timeline["time"][byKey])
+    release = (ops[byKey] == NOTE_OFF) & ~startsTogether
+    order[byKey[release]] = RELEASE_FIRST
+    return timeline[np.lexsort((np.arange(len(timeline)), order, timeline["time"]))]
+
+
+def getBend(low, high):
+    # 14 bit pitch bend value of a PITCH_BEND row
+    return (high << 7) | low
+
+
+def getSoundingNotes(timeline, index):
+    # the NOTE_ON rows before index whose note is still held at index, in start order
+    past = timeline[:index]
+    past = past[past["op"] != PITCH_BEND]
+    index = len(past)
+    keys = past["channel"].astype(np.int64) * 128 + past["note"]
+    # the last event of every channel/note decides whether it sounds
+    unused, lastFromEnd = np.unique(keys[::-1], return_index=True)
+    last = past[np.sort(index - 1 - lastFromEnd)]
+    return last[last["op"] == NOTE_ON]
+
+
+def getChannelBends(timeline, index):
+    # the last PITCH_BEND row of every channel before index
+    past = timeline[:index]
+    bends = past[past["op"] == PITCH_BEND]
+    unused, lastFromEnd = np.unique(bends["channel"][::-1], return_index=True)
+    return bends[np.sort(len(bends) - 1 - lastFromEnd)]
@@ -0,0 +1,98 @@
+import itertools
+import json
+from time import perf_counter_ns
+import numpy as np
+
+# stages of the playback path that can be traced
+DISPATCH = 0    # one timeline event in TimelinePlayer, allocation and encoding included
+ALLOCATE = 1    # VoiceAllocator.allocate in ChannelHandler.startTone
+SEND = 2        # DSPInterface.sendCommand, value = bytes of the command
+QUEUE = 3       # time a transfer waited in the UsbWriter queue
+WRITE = 4       # transport.write, value = bytes of the transfer
+STAGE_NAMES = ["dispatch", "allocate", "sendCommand", "queue", "write"]
+# the thread a stage runs in, for the trace viewer
+STAGE_THREADS = [1, 1, 1, 2, 2]
+
+
+class Tracer:
+    # Nanosecond spans of the playback stages in preallocated arrays used as a ring buffer, the
+    # newest capacity spans are kept. record() may be called from several threads, the slot comes
+    # from an itertools counter, which is atomic under the GIL.
+    def __init__(self, capacity=1 << 16) -> None:
+        self.capacity = capacity
+        self.stage = np.zeros(capacity, dtype=np.uint8)
+        self.start = np.zeros(capacity, dtype=np.int64)
+        self.duration = np.zeros(capacity, dtype=np.int64)
+        self.value = np.zeros(capacity, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self.counter = itertools.count()
+        self.count = 0
+
+    def record(self, stage, start, end=None, value=0):
+        # end defaults to now
+        if end is None:
+            end = perf_counter_ns()
+        count = next(self.counter)
+        slot = count % self.capacity
+        self.stage[slot] = stage
+        self.start[slot] = start
+        self.duration[slot] = end - start
+        self.value[slot] = value
+        self.count = max(self.count, count + 1)
+
+    def getSpans(self):
+        # (stage, start, duration, value) arrays of the kept spans ordered by start
+        size = min(self.count, self.capacity)
+        order = np.argsort(self.start[:size], kind='stable')
+        return self.stage[:size][order], self.start[:size][order], self.duration[:size][order], self.value[:size][order]
+
+    def getSummary(self):
+        stages, starts, durations, values = self.getSpans()
+        if not len(stages):
+            return None
+        span = (starts[-1] + durations[-1] - starts[0]) / 1e9
+        summary = {"spans": len(stages), "dropped": max(self.count - self.capacity, 0), "seconds": span, "stages": {}}
+        for stage, name in enumerate(STAGE_NAMES):
+            selection = stages == stage
+            if not selection.any():
+                continue
+            micros = durations[selection] / 1000
+            summary["stages"][name] = {
+                "count": int(selection.sum()),
+                "p50": float(np.percentile(micros, 50)),
+                "p99": float(np.percentile(micros, 99)),
+                "max": float(micros.max()),
+            }
+        sends = stages == SEND
+        writes = stages == WRITE
+        summary["commandsPerSecond"] = sends.sum() / span if span else 0.0
+        summary["bytesPerSecond"] = values[writes].sum() / span if span else 0.0
+        return summary
+
+    def getReport(self):
+        summary = self.getSummary()
+        if summary is None:
+            return "Trace: nothing recorded"
+        lines = ["Trace of {:.2f} s: {:.0f} commands/s, {:.0f} bytes/s{}".format(
+            summary["seconds"], summary["commandsPerSecond"], summary["bytesPerSecond"],
+            ", {} oldest spans dropped".format(summary["dropped"]) if summary["dropped"] else "")]
+        for name, stage in summary["stages"].items():
+            lines.append("  {:12} {:8d} x  p50 {:8.1f} us  p99 {:8.1f} us  max {:8.1f} us".format(
+                name, stage["count"], stage["p50"], stage["p99"], stage["max"]))
+        return "\n".join(lines)
+
+    def writeChromeTrace(self, path):
+        # complete events ("ph": "X") in microseconds, opens in chrome://tracing or Perfetto
+        stages, starts, durations, values = self.getSpans()
+        origin = starts[0] if len(starts) else 0
+        events = []
+        for stage, start, duration, value in zip(stages.tolist(), starts.tolist(), durations.tolist(), values.tolist()):
+            event = {"name": STAGE_NAMES[stage], "ph": "X", "ts": (start - origin) / 1000, "dur": duration / 1000,
+                     "pid": 1, "tid": STAGE_THREADS[stage]}
+            if value:
+                event["args"] = {"bytes": value}
+            events.append(event)
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
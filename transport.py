@@ -0,0 +1,169 @@
+import usb
+import usb.core
+import usb.util
+import libusb_package
+from enum import Enum
+from time import perf_counter_ns, sleep
+
+class DSPCommands(Enum):
+    StartTone = 1
+    StopTone = 2
+    Reset = 3
+    SetVolume = 4
+    SetFrequency = 5
+
+# payload bytes following the 2 byte opcode of every command
+COMMAND_LENGTHS = {
+    DSPCommands.StartTone: 6,   # channel, frequency, gain (16 bit each)
+    DSPCommands.StopTone: 2,    # channel
+    DSPCommands.Reset: 0,
+    DSPCommands.SetVolume: 2,   # volume
+    DSPCommands.SetFrequency: 4,    # channel, frequency (pitch bend of a sounding tone)
+}
+
+# A transport takes the encoded bytes of one or more commands (see DSPInterface.encodeCommand).
+# It needs a write(data) method, a maxPacketSize attribute and close().
+
+
+# USB ids of the DSP board
+VENDOR_ID = 0x0c55
+PRODUCT_ID = 0x1234
+
+
+def findUsbTransports():
+    # one transport for every attached DSP board
+    be = libusb_package.get_libusb1_backend()
+    devices = list(usb.core.find(find_all=True, idVendor=VENDOR_ID, idProduct=PRODUCT_ID, backend=be))
+    if not devices:
+        raise ValueError('Device not found')
+    return [UsbTransport(dev) for dev in devices]
+
+
+class UsbTransport:
+    # a DSP board, first OUT endpoint of the given device or of the first one with VID 0x0c55 / PID 0x1234
+    def __init__(self, dev=None) -> None:
+        self.initUsb(dev)
+        self.maxPacketSize = self.ep.wMaxPacketSize
+
+    def initUsb(self, dev=None):
+        be = libusb_package.get_libusb1_backend()
+
+        # find our device
+        self.dev = dev if dev is not None else usb.core.find(idVendor=VENDOR_ID, idProduct=PRODUCT_ID, backend=be)
+
+        # was it found?
+        if self.dev is None:
+            raise ValueError('Device not found')
+
+        # set the active configuration. With no arguments, the first
+        # configuration will be the active one
+        self.dev.set_configuration()
+
+        # get an endpoint instance
+        cfg = self.dev.get_active_configuration()
+        intf = cfg[(0,0)]
+
+        self.ep = usb.util.find_descriptor(
+            intf,
+            # match the first OUT endpoint
+            custom_match = \
+            lambda e: \
+                usb.util.endpoint_direction(e.bEndpointAddress) == \
+                usb.util.ENDPOINT_OUT)
+
+    def write(self, data):
+        self.ep.write(data)
+
+    def close(self):
+        usb.util.dispose_resources(self.dev)
+
+
+class SimulatedTransport:
+    # In-process stand-in for the DSP board: decodes the commands like the firmware, keeps the
+    # state of every oscillator and timestamps each command, so the player can run without USB.
+    def __init__(self, numberOfChannels=16, maxPacketSize=64, latency=0.0) -> None:
+        self.numberOfChannels = numberOfChannels
+        self.maxPacketSize = maxPacketSize
+        # simulated duration of one transfer in seconds
+        self.latency = latency
+        self.reset()
+        # (timestamp in ns, command, payload) of every received command
+        self.commands = []
+        self.transfers = 0
+        self.bytesWritten = 0
+
+    def reset(self):
+        self.frequency = [0] * self.numberOfChannels
+        self.gain = [0] * self.numberOfChannels
+        self.active = [False] * self.numberOfChannels
+        self.volume = 0
+
+    def getTimestamp(self):
+        return perf_counter_ns()
+
+    def write(self, data):
+        timestamp = self.getTimestamp()
+        if self.latency:
+            sleep(self.latency)
+        self.transfers += 1
+        self.bytesWritten += len(data)
+        # a transfer may hold several commands (framing)
+        offset = 0
+        while offset < len(data):
+            try:
+                command = DSPCommands(int.from_bytes(data[offset:offset + 2], 'little'))
+            except ValueError:
+                raise IOError("Unknown DSP command in " + bytes(data).hex())
+            length = COMMAND_LENGTHS[command]
+            payload = int.from_bytes(data[offset + 2:offset + 2 + length], 'little')
+            self.execute(command, payload)
+            self.commands.append((timestamp, command, payload))
+            offset += 2 + length
+
+    def execute(self, command, payload):
+        if command == DSPCommands.StartTone:
+            channel = payload & 0xffff
+            self.frequency[channel] = (payload >> 16) & 0xffff
+            self.gain[channel] = payload >> 32
+            self.active[channel] = True
+        elif command == DSPCommands.StopTone:
+            self.active[payload] = False
+        elif command == DSPCommands.SetFrequency:
+            self.frequency[payload & 0xffff] = payload >> 16
+        elif command == DSPCommands.SetVolume:
+            self.volume = payload
+        elif command == DSPCommands.Reset:
+            self.reset()
+
+    def getActiveCount(self):
+        return sum(self.active)
+
+    def getStats(self):
+        # throughput over the time span of all received commands
+        count = len(self.commands)
+        duration = (self.commands[-1][0] - self.commands[0][0]) / 1e9 if count > 1 else 0.0
+        return {
+            "commands": count,
+            "transfers": self.transfers,
+            "bytes": self.bytesWritten,
+            "duration": duration,
+            "commandsPerSecond": count / duration if duration else 0.0,
+        }
+
+    def close(self):
+        pass
+
+
+class NullTransport:
+    # discards everything, for measuring the host side of the playback path
+    def __init__(self, maxPacketSize=64) -> None:
+        self.maxPacketSize = maxPacketSize
+        self.transfers = 0
+        self.bytesWritten = 0
+
+    def write(self, data):
+        self.transfers += 1
+        self.bytesWritten += len(data)
+
+    def close(self):
+        pass
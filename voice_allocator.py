@@ -0,0 +1,107 @@
+from collections import OrderedDict
+
+
+class VoiceAllocator:
+    # Maps (note, midi channel) to one of the DSP voices. A free list and a key -> voice map make
+    # start and stop O(1); when all voices are busy the policy decides which one is stolen:
+    #   "oldest"   the voice that started first
+    #   "quietest" the voice with the lowest velocity
+    #   "channel"  a voice of the midi channel with the lowest priority (oldest of those), a new
+    #              note of a channel with an even lower priority is dropped instead
+    #   "none"     no stealing, the new note is dropped
+    # The voices may be split into groups of groupSize (one group per DSP board). A free voice is
+    # then taken from the group that already plays most notes of the midi channel (affinity), of
+    # those from the group with most free voices (load balancing).
+    POLICIES = ("oldest", "quietest", "channel", "none")
+
+    def __init__(self, voiceCount, policy="oldest", channelPriority=None, groupSize=None) -> None:
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown voice stealing policy " + str(policy))
+        self.voiceCount = voiceCount
+        self.groupSize = groupSize or voiceCount
+        self.groupCount = (voiceCount + self.groupSize - 1) // self.groupSize
+        self.policy = policy
+        # higher value = more important, by default lower midi channels win
+        self.channelPriority = channelPriority or [16 - channel for channel in range(16)]
+        self.stolen = 0
+        self.dropped = 0
+        self.reset()
+
+    def reset(self):
+        # free voices of every group, popped from the end so lower voices are used first
+        self.free = [list(range(min(start + self.groupSize, self.voiceCount) - 1, start - 1, -1))
+                     for start in range(0, self.voiceCount, self.groupSize)]
+        # sounding voices of every midi channel in every group
+        self.channelVoices = [[0] * 16 for group in range(self.groupCount)]
+        # key -> voice in start order, the first entry is the oldest voice
+        self.active = OrderedDict()
+        self.voiceKey = [None] * self.voiceCount
+        self.voiceVelocity = [0] * self.voiceCount
+
+    def getKey(self, note, midiChannel):
+        return (midiChannel << 7) | note
+
+    def allocate(self, note, midiChannel, velocity):
+        # returns the voice to play the note on or None if it has to be dropped
+        key = self.getKey(note, midiChannel)
+        voice = self.active.pop(key, None)
+        if voice is None:
+            group = self.selectGroup(midiChannel)
+            if group is not None:
+                voice = self.free[group].pop()
+            else:
+                voice = self.selectVictim(midiChannel)
+                if voice is None:
+                    self.dropped += 1
+                    return None
+                victimKey = self.voiceKey[voice]
+                del self.active[victimKey]
+                self.channelVoices[voice // self.groupSize][victimKey >> 7] -= 1
+                self.stolen += 1
+            self.channelVoices[voice // self.groupSize][midiChannel] += 1
+        # a repeated note starts again on its voice
+        self.active[key] = voice
+        self.voiceKey[voice] = key
+        self.voiceVelocity[voice] = velocity
+        return voice
+
+    def release(self, note, midiChannel):
+        # returns the voice that played the note or None if it is not sounding (anymore)
+        voice = self.active.pop(self.getKey(note, midiChannel), None)
+        if voice is not None:
+            self.voiceKey[voice] = None
+            group = voice // self.groupSize
+            self.free[group].append(voice)
+            self.channelVoices[group][midiChannel] -= 1
+        return voice
+
+    def selectGroup(self, midiChannel):
+        # the group to take a free voice from or None if all voices are busy
+        if self.groupCount == 1:
+            return 0 if self.free[0] else None
+        best = None
+        bestScore = None
+        for group in range(self.groupCount):
+            if self.free[group]:
+                score = (self.channelVoices[group][midiChannel], len(self.free[group]))
+                if bestScore is None or score > bestScore:
+                    best = group
+                    bestScore = score
+        return best
+
+    def selectVictim(self, midiChannel):
+        # the voice to steal for a new note of midiChannel or None if the new note is dropped
+        if self.policy == "oldest":
+            return next(iter(self.active.values()))
+        if self.policy == "quietest":
+            return min(self.active.values(), key=self.voiceVelocity.__getitem__)
+        if self.policy == "channel":
+            # active is in start order and min() keeps the first, so ties steal the oldest voice
+            voice = min(self.active.values(), key=lambda voice: self.channelPriority[self.voiceKey[voice] >> 7])
+            if self.channelPriority[midiChannel] < self.channelPriority[self.voiceKey[voice] >> 7]:
+                return None
+            return voice
+        return None
+
+    def __len__(self):
+        return len(self.active)